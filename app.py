@@ -8,14 +8,19 @@ from dotenv import load_dotenv
 from requests_oauthlib import OAuth1Session
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-from extensions import db
+from extensions import db, limiter
 from routes.main import main
 from routes.auth import auth
 from models.user import User
 
 # ★★★ ここを追加
-from models.text_evaluation import load_offensive_dict_with_tokens, load_whitelist
+from models.text_evaluation import load_offensive_dict_with_tokens, load_whitelist, compile_whitelist, build_client_prefilter, set_result_store
+from models.result_store import create_result_store
+from models.document_store import create_document_store
+from models.incremental import IncrementalEvaluator
+from models.tenant_dictionary import TenantMatcherCache
 
 load_dotenv()
 
@@ -28,10 +33,19 @@ def create_app():
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     app.config["JSON_AS_ASCII"] = False
 
+    # 信頼できるプロキシの数（Heroku のルーターなら 1）。0 なら X-Forwarded-For を信用しない
+    #   ip_key() のレート制限がクライアントの付けたヘッダーで回避されないよう、既定は 0
+    trusted_proxies = int(os.getenv("TRUSTED_PROXY_COUNT", "0"))
+    if trusted_proxies > 0:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies, x_proto=trusted_proxies)
+
     # SQLAlchemy + Migrate
     db.init_app(app)
     migrate = Migrate(app, db)
 
+    # レート制限 + アドミッション制御（評価エンドポイント用）
+    limiter.init_app(app)
+
     # Flask-Login
     login_manager = LoginManager()
     login_manager.init_app(app)
@@ -45,13 +59,21 @@ def create_app():
     app.register_blueprint(main)
     app.register_blueprint(auth)
 
+    # 負荷試験用のログイン代替（MOJITAP_TEST_LOGIN=1 のときだけ。本番DBでは有効にできない）
+    if os.getenv("MOJITAP_TEST_LOGIN") == "1":
+        if not app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+            raise RuntimeError("MOJITAP_TEST_LOGIN は SQLite のデータベースでのみ有効にできます")
+        from routes.testing import testing
+        app.register_blueprint(testing)
+
     # OAuth 初期化
     oauth = OAuth(app)
     oauth.init_app(app)
     app.config["OAUTH_INSTANCE"] = oauth
 
     # --- `data/` フォルダを確実に作成 ---
-    DATA_FOLDER = os.path.join(os.path.dirname(__file__), "data")
+    #     DATA_DIR で差し替え可能（負荷試験などでローカルの辞書フィクスチャを使う場合）
+    DATA_FOLDER = os.getenv("DATA_DIR") or os.path.join(os.path.dirname(__file__), "data")
     os.makedirs(DATA_FOLDER, exist_ok=True)
 
     # ▼▼▼ ダウンロード用関数群 ▼▼▼
@@ -74,7 +96,7 @@ def create_app():
 
     def download_offensive_words():
         dropbox_url = os.getenv("DROPBOX_OFFENSIVE_URL")
-        local_path = os.path.join(app.root_path, "data", "offensive_words.json")
+        local_path = os.path.join(DATA_FOLDER, "offensive_words.json")
         download_file(dropbox_url, local_path)
         if os.path.exists(local_path):
             try:
@@ -90,22 +112,36 @@ def create_app():
 
     def download_whitelist_json():
         dropbox_url = os.getenv("DROPBOX_WHITELIST_URL")
-        local_path = os.path.join(app.root_path, "data", "whitelist.json")
+        local_path = os.path.join(DATA_FOLDER, "whitelist.json")
         download_file(dropbox_url, local_path)
 
     def download_surnames():
         dropbox_url = os.getenv("DROPBOX_SURNAMES_URL")
-        local_csv_path = os.path.join(app.root_path, "data", "surnames.csv")
+        local_csv_path = os.path.join(DATA_FOLDER, "surnames.csv")
         if not dropbox_url:
             print("❌ DROPBOX_SURNAMES_URL が設定されていません")
             return
         download_file(dropbox_url, local_csv_path)
         print("✅ `surnames.csv` をダウンロードしました（ZIP解凍は不要）")
 
+    def download_surname_readings():
+        # update_offensive_words.py が作る data/surnames.json（苗字のカタカナ読み）。
+        # 無いと「やましたきらい」のようなかな書きの苗字を判定できないので、surnames.csv と同じく配布する
+        dropbox_url = os.getenv("DROPBOX_SURNAMES_READINGS_URL")
+        local_path = os.path.join(DATA_FOLDER, "surnames.json")
+        if dropbox_url:
+            download_file(dropbox_url, local_path)
+            if not os.path.exists(local_path):
+                raise RuntimeError(f"{local_path} をダウンロードできませんでした（DROPBOX_SURNAMES_READINGS_URL を確認してください）")
+        elif not os.path.exists(local_path):
+            print("❌ DROPBOX_SURNAMES_READINGS_URL が設定されておらず surnames.json もありません。"
+                  "かな書きの苗字は判定されません")
+
     # ダウンロード実行
     download_offensive_words()
     download_whitelist_json()
     download_surnames()
+    download_surname_readings()
 
     # --------------------------------------------------------
     # ★ ここで text_evaluation.py の関数を使って token 化する
@@ -116,8 +152,9 @@ def create_app():
         #   または text_evaluation.py 側に
         #   「既存 dict を token 化する関数」を作ってもOK
         #   ここではシンプルにファイルをもう一度読む方法を例示
+        #   ワーカーごとにメモリを食わないよう、列指向のコンパクト表現で保持する
         offensive_list = load_offensive_dict_with_tokens(
-            os.path.join(app.root_path, "data", "offensive_words.json")
+            os.path.join(DATA_FOLDER, "offensive_words.json"), compact=True
         )
         app.config["OFFENSIVE_LIST"] = offensive_list
     else:
@@ -125,9 +162,27 @@ def create_app():
 
     # whitelist.json → set 化
     whitelist_set = load_whitelist(
-        os.path.join(app.root_path, "data", "whitelist.json")
+        os.path.join(DATA_FOLDER, "whitelist.json")
     )
     app.config["WHITELIST_SET"] = whitelist_set
+    # 入力中のホワイトリスト span を辞書マッチ前に塗りつぶすためのコンパイル済みマッチャー
+    app.config["WHITELIST_MATCHER"] = compile_whitelist(whitelist_set)
+
+    # ワーカー間で共有する判定結果ストア（RESULT_STORE=sqlite / redis のときだけ）
+    set_result_store(create_result_store(data_dir=DATA_FOLDER))
+
+    # 入力途中のインクリメンタル判定。文書（全文・区間の判定）は文書ストアでワーカー間に共有する
+    # （DOCUMENT_STORE="" ならワーカー内だけ。その場合ワーカーが複数ならスティッキーセッションが必要）
+    app.config["INCREMENTAL_EVALUATOR"] = IncrementalEvaluator(
+        app.config["OFFENSIVE_LIST"], app.config["WHITELIST_MATCHER"],
+        store=create_document_store(data_dir=DATA_FOLDER),
+    )
+
+    # テナント（ユーザー / 組織）ごとの追加辞書。初回利用時にコンパイルし、メモリ上限つき LRU に置く
+    app.config["TENANT_MATCHER_CACHE"] = TenantMatcherCache.from_env()
+
+    # detector.js に配信するプレフィルタ（辞書 n-gram の Bloom filter。平文の語は含まない）
+    app.config["PREFILTER"] = build_client_prefilter(app.config["OFFENSIVE_LIST"])
 
     # OAuth登録 (Google, Twitter)
     oauth.register(
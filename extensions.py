@@ -1,3 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from rate_limit import RateLimiter
 
 db = SQLAlchemy()
+limiter = RateLimiter()
@@ -0,0 +1,312 @@
+"""
+HTTP 負荷試験ハーネス
+
+SQLite + ローカル辞書フィクスチャ（loadtest_fixtures/）+ テスト用ログイン代替でアプリを起動し、
+/quick_check・/report_offensive・静的ファイルに並列でリクエストを投げて
+スループットと p50/p95/p99 レイテンシを表示する。
+
+    # アプリをプロセス内（werkzeug, threaded）で起動して 8 並列 × 30 秒
+    python loadtest.py --concurrency 8 --duration 30
+
+    # 本番と同じ gunicorn で起動（ワーカー数の見積もり用）
+    python loadtest.py --gunicorn-workers 4 --concurrency 16
+
+    # ワーカー数を超える負荷で、待ち時間によるアドミッション制御（429）が効くことを確かめる
+    python loadtest.py --gunicorn-workers 2 --concurrency 64 --mix quick_check=1 --max-queue-time 0.2
+
+    # 起動済みのサーバー（MOJITAP_TEST_LOGIN=1 で起動したもの）を叩く
+    python loadtest.py --url http://127.0.0.1:8000
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import logging
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BASE_DIR, "loadtest_fixtures")
+
+SAMPLE_TEXTS = [
+    "今日はいい天気ですね",
+    "ありがとう、助かりました",
+    "お前はバカだな",
+    "山下ってブスだよな",
+    "山下さんが嫌い",
+    "死ね",
+    "お前消えろ",
+    "晒してやる",
+    "ゴミ出しは月曜日です",
+    "バカみたいに楽しい一日だった",
+    "あいつは詐欺師で犯罪者だ",
+    "普通の文章です",
+]
+
+STATIC_PATHS = ["/static/detector.js", "/robots.txt", "/prefilter.json", "/terms"]
+
+# シナリオ名 → 重み
+DEFAULT_MIX = {"quick_check": 6, "report_offensive": 1, "static": 3}
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _prepare_env(workdir, rate_limits=False, max_queue_time=None):
+    """
+    フィクスチャを一時ディレクトリにコピーし、アプリ用の環境変数を作る
+    """
+    data_dir = os.path.join(workdir, "data")
+    shutil.copytree(FIXTURES_DIR, data_dir)
+    env = {
+        "DATA_DIR": data_dir,
+        "DATABASE_URL": "sqlite:///" + os.path.join(workdir, "loadtest.db"),
+        "MOJITAP_TEST_LOGIN": "1",
+        "SECRET_KEY": "loadtest",
+        # .env に本番の URL があってもダウンロードしない（空文字は load_dotenv で上書きされない）
+        "DROPBOX_OFFENSIVE_URL": "",
+        "DROPBOX_WHITELIST_URL": "",
+        "DROPBOX_SURNAMES_URL": "",
+        "DROPBOX_SURNAMES_READINGS_URL": "",
+        # 本番と同じく、アドミッション制御は全ワーカー共有の sqlite バックエンドで行う
+        "RATE_LIMIT_BACKEND": "sqlite",
+    }
+    if not rate_limits:
+        # ユーザー単位の制限は外して、サーバーの処理能力そのものを測る（同時実行数の制御は残す）
+        env.update({
+            "RATE_LIMIT_QUICK_CHECK": "1000000/1",
+            "RATE_LIMIT_API_QUICK_CHECK": "1000000/1",
+            "RATE_LIMIT_REPORT_OFFENSIVE": "1000000/1",
+        })
+    if max_queue_time is not None:
+        env["MAX_QUEUE_TIME"] = str(max_queue_time)
+    return env
+
+
+def _wait_ready(base_url, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(base_url + "/robots.txt", timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{base_url} が {timeout} 秒以内に起動しませんでした")
+
+
+def start_inprocess(env):
+    """
+    同じプロセス内で werkzeug の threaded サーバーを起動する
+    """
+    os.environ.update(env)
+    sys.path.insert(0, BASE_DIR)
+    from werkzeug.serving import make_server
+    from app import app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # アクセスログで結果が埋もれないように
+    port = _free_port()
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return f"http://127.0.0.1:{port}", server.shutdown
+
+
+def start_gunicorn(env, workers, threads):
+    """
+    Procfile と同じ gunicorn wsgi:app をサブプロセスで起動する
+    """
+    port = _free_port()
+    cmd = [
+        sys.executable, "-m", "gunicorn", "wsgi:app",
+        "--bind", f"127.0.0.1:{port}",
+        "--workers", str(workers),
+        "--threads", str(threads),
+        "--log-level", "warning",
+    ]
+    proc = subprocess.Popen(cmd, cwd=BASE_DIR, env={**os.environ, **env})
+
+    def stop():
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    return f"http://127.0.0.1:{port}", stop
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)   # シナリオ → [秒]
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, name, elapsed, status):
+        with self.lock:
+            self.latencies[name].append(elapsed)
+            self.statuses[name][status] += 1
+
+
+def percentile(sorted_values, p):
+    """nearest-rank 方式"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def _pick_text(rng, unique_ratio):
+    text = rng.choice(SAMPLE_TEXTS)
+    # 判定キャッシュに当たらない入力も混ぜる
+    if rng.random() < unique_ratio:
+        text = f"{text} #{rng.randrange(10 ** 9)}"
+    return text
+
+
+def run_client(base_url, client_id, stop_at, stats, mix, unique_ratio, max_requests):
+    rng = random.Random(client_id)
+    session = requests.Session()
+    resp = session.post(f"{base_url}/_test/login/loadtest-{client_id}", timeout=30)
+    resp.raise_for_status()
+
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    done = 0
+    while time.time() < stop_at and (max_requests is None or done < max_requests):
+        name = rng.choices(names, weights)[0]
+        started = time.perf_counter()
+        # 本番の前段（Heroku のルーター）と同じく受付時刻を付ける。サーバーはここからの待ち時間で混雑を判定する
+        headers = {"X-Request-Start": f"t={time.time():.6f}"}
+        try:
+            if name == "quick_check":
+                r = session.post(f"{base_url}/quick_check",
+                                 data={"text": _pick_text(rng, unique_ratio)}, headers=headers, timeout=60)
+            elif name == "report_offensive":
+                r = session.post(f"{base_url}/report_offensive",
+                                 json={"text": _pick_text(rng, unique_ratio), "judgement": "問題ありません"},
+                                 headers=headers, timeout=60)
+            else:
+                r = session.get(base_url + rng.choice(STATIC_PATHS), headers=headers, timeout=60)
+            status = r.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        stats.record(name, time.perf_counter() - started, status)
+        done += 1
+        if status == 429:
+            # 行儀のよいクライアントと同じく Retry-After だけ待ってから次を送る
+            time.sleep(min(float(r.headers.get("Retry-After", 1)), max(0.0, stop_at - time.time())))
+
+
+def report(stats, wall):
+    rows = []
+    all_latencies = []
+    for name in sorted(stats.latencies):
+        values = sorted(stats.latencies[name])
+        all_latencies.extend(values)
+        rows.append((name, values, dict(stats.statuses[name])))
+    all_latencies.sort()
+    rows.append(("TOTAL", all_latencies, {}))
+
+    result = {"wall_seconds": round(wall, 3), "routes": {}}
+    print(f"\n{'route':<18}{'count':>8}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}  status")
+    for name, values, statuses in rows:
+        entry = {
+            "count": len(values),
+            "rps": round(len(values) / wall, 2) if wall else 0.0,
+            "p50_ms": round(percentile(values, 50) * 1000, 1),
+            "p95_ms": round(percentile(values, 95) * 1000, 1),
+            "p99_ms": round(percentile(values, 99) * 1000, 1),
+            "max_ms": round((values[-1] if values else 0) * 1000, 1),
+            "status": {str(k): v for k, v in statuses.items()},
+        }
+        result["routes"][name] = entry
+        status_text = " ".join(f"{k}:{v}" for k, v in sorted(entry["status"].items()))
+        print(f"{name:<18}{entry['count']:>8}{entry['rps']:>9}{entry['p50_ms']:>9}"
+              f"{entry['p95_ms']:>9}{entry['p99_ms']:>9}{entry['max_ms']:>9}  {status_text}")
+    return result
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown scenario: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MojiTap HTTP 負荷試験")
+    parser.add_argument("--url", help="起動済みサーバーの URL（MOJITAP_TEST_LOGIN=1 で起動しておくこと）")
+    parser.add_argument("--gunicorn-workers", type=int, default=0, help="gunicorn をこのワーカー数で起動する（0 = プロセス内 werkzeug）")
+    parser.add_argument("--gunicorn-threads", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=8, help="並列クライアント数")
+    parser.add_argument("--duration", type=float, default=30.0, help="計測秒数")
+    parser.add_argument("--requests", type=int, default=None, help="クライアントごとの最大リクエスト数")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="例: quick_check=6,report_offensive=1,static=3")
+    parser.add_argument("--unique-ratio", type=float, default=0.5, help="判定キャッシュに当たらない入力の割合")
+    parser.add_argument("--rate-limits", action="store_true", help="ユーザー / IP ごとのレート制限を有効のまま計測する")
+    parser.add_argument("--max-queue-time", type=float, default=None,
+                        help="サーバーの MAX_QUEUE_TIME（秒）。これ以上待たされた評価リクエストは 429 になる")
+    parser.add_argument("--json", help="結果を JSON で保存するパス")
+    args = parser.parse_args(argv)
+
+    workdir = None
+    stop = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        workdir = tempfile.mkdtemp(prefix="mojitap-loadtest-")
+        env = _prepare_env(workdir, rate_limits=args.rate_limits, max_queue_time=args.max_queue_time)
+        if args.gunicorn_workers > 0:
+            base_url, stop = start_gunicorn(env, args.gunicorn_workers, args.gunicorn_threads)
+        else:
+            base_url, stop = start_inprocess(env)
+
+    try:
+        _wait_ready(base_url)
+        stats = Stats()
+        print(f"▶ {base_url} に {args.concurrency} 並列で {args.duration} 秒間リクエストします")
+        started = time.perf_counter()
+        stop_at = time.time() + args.duration
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            futures = [
+                pool.submit(run_client, base_url, i, stop_at, stats, args.mix, args.unique_ratio, args.requests)
+                for i in range(args.concurrency)
+            ]
+            for f in futures:
+                f.result()
+        result = report(stats, time.perf_counter() - started)
+        result.update({
+            "url": base_url,
+            "concurrency": args.concurrency,
+            "gunicorn_workers": args.gunicorn_workers,
+            "gunicorn_threads": args.gunicorn_threads,
+        })
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(result, f, indent=2, ensure_ascii=False)
+    finally:
+        if stop:
+            stop()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+from extensions import db
+from datetime import datetime
+
+# テナント（ユーザー / 組織）ごとの追加辞書
+#   kind = "offensive" : グローバル辞書に追加で検出する語
+#   kind = "whitelist" : グローバル辞書の語でも、このテナントでは除外する語
+OWNER_USER = "user"
+OWNER_ORGANIZATION = "organization"
+KIND_OFFENSIVE = "offensive"
+KIND_WHITELIST = "whitelist"
+
+class CustomDictionaryEntry(db.Model):
+    __tablename__ = "custom_dictionary_entry"
+    __table_args__ = (
+        db.UniqueConstraint("owner_type", "owner_id", "kind", "word", name="uq_custom_dictionary_entry"),
+        db.Index("ix_custom_dictionary_owner", "owner_type", "owner_id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    owner_type = db.Column(db.String(20), nullable=False)   # "user" / "organization"
+    owner_id = db.Column(db.String(255), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)         # "offensive" / "whitelist"
+    word = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {"id": self.id, "owner_type": self.owner_type, "kind": self.kind, "word": self.word}
+
+class OrganizationMember(db.Model):
+    __tablename__ = "organization_member"
+    __table_args__ = (
+        db.UniqueConstraint("organization_id", "user_id", name="uq_organization_member"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    organization_id = db.Column(db.String(255), nullable=False, index=True)
+    user_id = db.Column(db.String(255), db.ForeignKey("user.id"), nullable=False, index=True)
@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import threading
+
+try:
+    import redis  # 任意（DOCUMENT_STORE=redis のときだけ必要）
+except ImportError:
+    redis = None
+
+# =========================================
+# インクリメンタル判定の文書をワーカー間で共有するストア
+# =========================================
+# IncrementalEvaluator の文書（全文）はワーカーごとのメモリにあるので、gunicorn のワーカーが複数だと
+# 編集リクエストが open() と別のワーカーに届いたときに文書が見つからない。
+# ここには文書ごとの (全文, リビジョン) と、区間（文）ごとの判定結果を置く。
+#   - 文書 : 編集のたびにリビジョンを変える。ワーカーは手元のリビジョンと比べ、古ければ全文から組み立て直す
+#   - 区間 : (辞書バージョン, 区間テキスト) → analyze_segment() の結果。組み立て直しはほぼ区間の読み出しだけで済む
+#   - SQLiteDocumentStore : 同一ノードの全ワーカーで共有（WAL モード）
+#   - RedisDocumentStore  : 複数ノードで共有
+#
+# 環境変数:
+#   DOCUMENT_STORE        "sqlite"（既定） / "redis" / ""（共有しない。ワーカーが複数ならスティッキーセッションが必要）
+#   DOCUMENT_STORE_PATH   sqlite のファイル（既定: DATA_DIR/documents.sqlite3）
+#   DOCUMENT_STORE_URL    redis の URL（既定: redis://localhost:6379/0）
+#   DOCUMENT_STORE_TTL    最後の編集からの有効期限（秒、既定 1 時間）
+
+DEFAULT_TTL = 3600
+
+
+class SQLiteDocumentStore:
+    _PRUNE_PROBABILITY = 0.001  # 書き込み 1000 回に 1 回くらい期限切れを掃除する
+
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents "
+            "(key TEXT PRIMARY KEY, text TEXT NOT NULL, revision TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS documents_updated ON documents (updated)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS segments (key TEXT PRIMARY KEY, result TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS segments_updated ON segments (updated)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---- 文書 ----
+    def get_document(self, key):
+        """
+        :return: (全文, リビジョン)。無い・期限切れなら None
+        """
+        row = self._conn().execute(
+            "SELECT text, revision, updated FROM documents WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[2] < time.time() - self.ttl:
+            return None
+        return (row[0], row[1])
+
+    def put_document(self, key, text, revision, previous=None):
+        """
+        previous が指定されていれば、保存されているリビジョンが previous のときだけ書き換える
+        :return: 書き換えたか（False なら別のワーカーが先に編集した）
+        """
+        conn = self._conn()
+        now = time.time()
+        if previous is None:
+            conn.execute(
+                "INSERT OR REPLACE INTO documents (key, text, revision, updated) VALUES (?, ?, ?, ?)",
+                (key, text, revision, now),
+            )
+            updated = True
+        else:
+            cursor = conn.execute(
+                "UPDATE documents SET text = ?, revision = ?, updated = ? WHERE key = ? AND revision = ?",
+                (text, revision, now, key, previous),
+            )
+            updated = cursor.rowcount == 1
+        if random.random() < self._PRUNE_PROBABILITY:
+            self.prune()
+        return updated
+
+    def delete_document(self, key):
+        self._conn().execute("DELETE FROM documents WHERE key = ?", (key,))
+
+    # ---- 区間の判定結果 ----
+    def get_segment(self, key):
+        row = self._conn().execute("SELECT result, updated FROM segments WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time() - self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def set_segment(self, key, result):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO segments (key, result, updated) VALUES (?, ?, ?)",
+            (key, json.dumps(result, ensure_ascii=False), time.time()),
+        )
+
+    def prune(self):
+        conn = self._conn()
+        expired = time.time() - self.ttl
+        conn.execute("DELETE FROM documents WHERE updated < ?", (expired,))
+        conn.execute("DELETE FROM segments WHERE updated < ?", (expired,))
+
+
+class RedisDocumentStore:
+    # 保存されているリビジョンが ARGV[3] のときだけ書き換える（ARGV[3] が空なら無条件）
+    _PUT_SCRIPT = """
+if ARGV[3] ~= '' and redis.call('HGET', KEYS[1], 'revision') ~= ARGV[3] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'text', ARGV[1], 'revision', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+    def __init__(self, url, ttl=DEFAULT_TTL, prefix="mojitap:document:"):
+        if redis is None:
+            raise RuntimeError("DOCUMENT_STORE=redis には redis パッケージが必要です（pip install redis）")
+        self.client = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self._put = self.client.register_script(self._PUT_SCRIPT)
+
+    def get_document(self, key):
+        text, revision = self.client.hmget(self.prefix + key, "text", "revision")
+        if text is None or revision is None:
+            return None
+        return (text.decode("utf-8"), revision.decode("utf-8"))
+
+    def put_document(self, key, text, revision, previous=None):
+        return bool(self._put(keys=[self.prefix + key], args=[text, revision, previous or "", self.ttl]))
+
+    def delete_document(self, key):
+        self.client.delete(self.prefix + key)
+
+    def get_segment(self, key):
+        raw = self.client.get(self.prefix + "segment:" + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set_segment(self, key, result):
+        self.client.setex(self.prefix + "segment:" + key, self.ttl, json.dumps(result, ensure_ascii=False))
+
+
+def create_document_store(kind=None, data_dir=None):
+    """
+    環境変数から文書ストアを作る。空文字なら None（ワーカー内だけで保持する）
+    """
+    kind = kind if kind is not None else os.getenv("DOCUMENT_STORE", "sqlite")
+    ttl = float(os.getenv("DOCUMENT_STORE_TTL", DEFAULT_TTL))
+    if not kind:
+        return None
+    if kind == "sqlite":
+        path = os.getenv("DOCUMENT_STORE_PATH") or os.path.join(
+            data_dir or os.path.join(os.path.dirname(__file__), "..", "data"), "documents.sqlite3"
+        )
+        return SQLiteDocumentStore(path, ttl=ttl)
+    if kind == "redis":
+        return RedisDocumentStore(os.getenv("DOCUMENT_STORE_URL", "redis://localhost:6379/0"), ttl=ttl)
+    raise ValueError(f"unknown DOCUMENT_STORE: {kind}")
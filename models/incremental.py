@@ -0,0 +1,257 @@
+import re
+import uuid
+import threading
+from collections import OrderedDict
+
+from .result_store import result_key
+from .text_evaluation import analyze_segment, combine_segments, compile_whitelist, result_version
+
+# =========================================
+# 入力途中のインクリメンタル判定
+# =========================================
+# 文書を文（。！？ や改行で終わる区間）に分け、区間ごとの判定結果を保持する。
+# 編集 (offset, 削除文字数, 挿入文字列) が来たら、編集が触れた区間だけを区切り直して再判定し、
+# 残りの区間は位置をずらして使い回す。文書全体の判定は combine_segments() で合成する。
+#
+# 判定の単位が「文」になるので、文をまたぐ辞書語・キーワードは拾わない
+# （苗字 + 否定語の組み合わせは文をまたいでも判定する）。
+#
+# 文書ストア（models/document_store.py）があれば、全文とリビジョン・区間の判定結果をワーカー間で共有する。
+# 編集が open() と別のワーカーに届いても、共有の全文から組み立て直して続けられる（区間は共有ストアから読む）。
+# 文書ストアが無い場合、文書はワーカー内にしか無いので、ワーカーが複数ならスティッキーセッションが必要。
+
+_SEGMENT = re.compile(r"[^。．！？!?\n]*[。．！？!?\n]+|[^。．！？!?\n]+")
+_TERMINATORS = frozenset("。．！？!?\n")
+
+MAX_DOCUMENTS = 1000        # プロセス内で保持する文書数（古いものから捨てる）
+SEGMENT_CACHE_SIZE = 5000   # (辞書バージョン, 区間テキスト) → 判定結果
+
+
+def split_segments(text, base=0):
+    """
+    :return: [(開始位置, 区間テキスト), ...]（base は開始位置に足すオフセット）
+    """
+    return [(base + m.start(), m.group()) for m in _SEGMENT.finditer(text)]
+
+
+class Segment:
+    __slots__ = ("start", "text", "result")
+
+    def __init__(self, start, text, result):
+        self.start = start
+        self.text = text
+        self.result = result
+
+    @property
+    def end(self):
+        return self.start + len(self.text)
+
+
+class DocumentState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.text = ""
+        self.segments = []
+        self.matchers = None    # (offensive_list, whitelist, 辞書バージョン)。open() のときに決まる
+        self.revision = None    # 文書ストアに書いたリビジョン（他のワーカーが編集したら食い違う）
+
+
+class EditError(ValueError):
+    """編集が保持している文書と合わない（クライアントは全文を送り直す）"""
+
+
+class IncrementalEvaluator:
+    def __init__(self, offensive_list, whitelist=None, max_documents=MAX_DOCUMENTS, store=None):
+        self.offensive_list = offensive_list
+        self.whitelist = whitelist
+        self.max_documents = max_documents
+        self.store = store
+        self._documents = OrderedDict()
+        self._segment_cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ---- 区間の判定（同じ辞書・同じ文は使い回す） ----
+    def _matchers(self, offensive_list=None, whitelist=None):
+        """
+        テナント辞書が指定されなければ、コンストラクタで渡された辞書を使う
+        """
+        offensive_list = self.offensive_list if offensive_list is None else offensive_list
+        whitelist = compile_whitelist(self.whitelist if whitelist is None else whitelist)
+        return offensive_list, whitelist, result_version(offensive_list, whitelist)
+
+    def _analyze(self, text, matchers):
+        offensive_list, whitelist, version = matchers
+        key = (version, text)
+        with self._lock:
+            result = self._segment_cache.get(key)
+            if result is not None:
+                self._segment_cache.move_to_end(key)
+                return result
+        result = self._shared_segment(text, version)
+        if result is None:
+            result = analyze_segment(text, offensive_list, whitelist)
+            self._share_segment(text, version, result)
+        with self._lock:
+            self._segment_cache[key] = result
+            if len(self._segment_cache) > SEGMENT_CACHE_SIZE:
+                self._segment_cache.popitem(last=False)
+        return result
+
+    def _shared_segment(self, text, version):
+        if self.store is None:
+            return None
+        try:
+            return self.store.get_segment(result_key(text, version))
+        except Exception as e:
+            print(f"⚠️ 文書ストアの読み込みに失敗: {e}")
+            return None
+
+    def _share_segment(self, text, version, result):
+        if self.store is None:
+            return
+        try:
+            self.store.set_segment(result_key(text, version), result)
+        except Exception as e:
+            print(f"⚠️ 文書ストアへの書き込みに失敗: {e}")
+
+    def _build(self, text, base, matchers):
+        return [Segment(start, seg, self._analyze(seg, matchers)) for start, seg in split_segments(text, base)]
+
+    def _verdict(self, doc_id, doc, reevaluated):
+        report = combine_segments(seg.result for seg in doc.segments)
+        report.update({
+            "doc_id": doc_id,
+            "length": len(doc.text),
+            "segments": len(doc.segments),
+            "reevaluated": reevaluated,
+        })
+        return report
+
+    # ---- 文書の管理 ----
+    def _get(self, doc_id, create=False):
+        with self._lock:
+            doc = self._documents.get(doc_id)
+            if doc is not None:
+                self._documents.move_to_end(doc_id)
+            elif create:
+                doc = self._documents[doc_id] = DocumentState()
+                while len(self._documents) > self.max_documents:
+                    self._documents.popitem(last=False)
+            return doc
+
+    def _load_shared(self, doc_id):
+        """
+        :return: 文書ストアの (全文, リビジョン)。ストアが無い・読めなければ False、文書が無ければ None
+        """
+        if self.store is None:
+            return False
+        try:
+            return self.store.get_document(doc_id)
+        except Exception as e:
+            print(f"⚠️ 文書ストアの読み込みに失敗: {e}")
+            return False
+
+    def _save_shared(self, doc_id, doc, previous=None):
+        """
+        doc の全文を新しいリビジョンで文書ストアに書く
+        :return: 書けたか（False なら別のワーカーが先に編集していた）
+        """
+        doc.revision = uuid.uuid4().hex
+        if self.store is None:
+            return True
+        try:
+            return self.store.put_document(doc_id, doc.text, doc.revision, previous)
+        except Exception as e:
+            print(f"⚠️ 文書ストアへの書き込みに失敗: {e}")
+            return True
+
+    def open(self, doc_id, text, offensive_list=None, whitelist=None):
+        """
+        全文を登録（または置き換え）して判定する
+        :param offensive_list, whitelist: テナント辞書（省略時はコンストラクタの辞書）。編集中はこの辞書で判定し続ける
+        """
+        doc = self._get(doc_id, create=True)
+        with doc.lock:
+            doc.matchers = self._matchers(offensive_list, whitelist)
+            doc.text = text
+            doc.segments = self._build(text, 0, doc.matchers)
+            self._save_shared(doc_id, doc)
+            return self._verdict(doc_id, doc, len(doc.segments))
+
+    def close(self, doc_id):
+        with self._lock:
+            self._documents.pop(doc_id, None)
+        if self.store is not None:
+            try:
+                self.store.delete_document(doc_id)
+            except Exception as e:
+                print(f"⚠️ 文書ストアからの削除に失敗: {e}")
+
+    def apply_edit(self, doc_id, offset, delete, insert, expected_length=None, offensive_list=None, whitelist=None):
+        """
+        :param offset: 編集位置（編集前の文字列での位置）
+        :param delete: offset から削除する文字数
+        :param insert: offset に挿入する文字列
+        :param expected_length: 編集後の全文の長さ（クライアントとずれていないかの確認用）
+        :param offensive_list, whitelist: 文書が別のワーカーで開かれていたときに組み立て直す辞書（省略時はコンストラクタの辞書）
+        :raises KeyError: 文書が無い（期限切れ・閉じた・文書ストアが無く別ワーカー）
+        :raises EditError: 編集が範囲外、長さが合わない、または別の編集と競合した
+        """
+        shared = self._load_shared(doc_id)
+        doc = self._get(doc_id, create=bool(shared))
+        if doc is None or shared is None:
+            with self._lock:
+                self._documents.pop(doc_id, None)
+            raise KeyError(doc_id)
+
+        with doc.lock:
+            if shared and doc.revision != shared[1]:
+                # 別のワーカーで開かれた・編集された文書。共有の全文から組み立て直す（区間の判定は共有ストアから読む）
+                doc.matchers = self._matchers(offensive_list, whitelist)
+                doc.text = shared[0]
+                doc.segments = self._build(doc.text, 0, doc.matchers)
+                doc.revision = shared[1]
+
+            old_text = doc.text
+            if offset < 0 or delete < 0 or offset + delete > len(old_text):
+                raise EditError("編集範囲が文書の外です")
+            new_text = old_text[:offset] + insert + old_text[offset + delete:]
+            if expected_length is not None and expected_length != len(new_text):
+                raise EditError("文書の長さが一致しません")
+            delta = len(insert) - delete
+            segments = doc.segments
+            previous = doc.revision
+
+            if not segments:
+                doc.text = new_text
+                doc.segments = self._build(new_text, 0, doc.matchers)
+                return self._commit(doc_id, doc, previous, len(doc.segments))
+
+            # 編集範囲 [offset, offset + delete] に触れる区間（境界に接するものも含む）
+            first = 0
+            while first < len(segments) - 1 and segments[first].end < offset:
+                first += 1
+            last = first
+            while last < len(segments) - 1 and segments[last + 1].start <= offset + delete:
+                last += 1
+
+            # 区切り直す範囲は、文末記号で終わるところまで後ろに広げる
+            start = segments[first].start
+            end = segments[last].end + delta
+            while last < len(segments) - 1 and (end <= start or new_text[end - 1] not in _TERMINATORS):
+                last += 1
+                end = segments[last].end + delta
+
+            rebuilt = self._build(new_text[start:end], start, doc.matchers)
+            for seg in segments[last + 1:]:
+                seg.start += delta
+
+            doc.text = new_text
+            doc.segments = segments[:first] + rebuilt + segments[last + 1:]
+            return self._commit(doc_id, doc, previous, len(rebuilt))
+
+    def _commit(self, doc_id, doc, previous, reevaluated):
+        if not self._save_shared(doc_id, doc, previous):
+            doc.revision = None  # 次の編集で共有の全文から組み立て直す
+            raise EditError("別の編集と競合しました")
+        return self._verdict(doc_id, doc, reevaluated)
@@ -1,8 +1,11 @@
 import csv
+import json
 import os
 
 # CSVファイルのパスを指定
-csv_file_path = os.path.join(os.path.dirname(__file__), "..", "data", "surnames.csv")
+csv_file_path = os.path.join(
+    os.getenv("DATA_DIR") or os.path.join(os.path.dirname(__file__), "..", "data"), "surnames.csv"
+)
 
 def load_surnames():
     """CSVファイルから苗字リストを読み込む関数"""
@@ -17,6 +20,29 @@ def load_surnames():
         print(f"エラーが発生しました: {e}")
     return surnames
 
+# update_offensive_words.py が作る成果物（人名 + pykakasi で事前計算したカタカナ読み）
+surnames_artifact_path = os.path.join(os.path.dirname(csv_file_path), "surnames.json")
+# 読みの作り方を変えたら update_offensive_words.ARTIFACT_FORMAT と一緒に上げる（古い形式の読みは使わない）
+READINGS_FORMAT = 3
+
+def load_surname_readings():
+    """surnames.json から {苗字: [カタカナ読み, ...]} を読み込む関数"""
+    try:
+        with open(surnames_artifact_path, mode="r", encoding="utf-8") as file:
+            artifact = json.load(file)
+        if artifact.get("format") != READINGS_FORMAT:
+            print(f"❌ {surnames_artifact_path} の形式が古いため、かな書きの苗字は判定されません"
+                  "（python update_offensive_words.py で作り直してください）")
+            return {}
+        return artifact.get("readings", {})
+    except FileNotFoundError:
+        print(f"❌ {surnames_artifact_path} がありません。かな書きの苗字は判定されません"
+              "（python update_offensive_words.py で作成し、DROPBOX_SURNAMES_READINGS_URL で配布してください）")
+        return {}
+    except Exception as e:
+        print(f"エラーが発生しました: {e}")
+        return {}
+
 # テスト用コード
 if __name__ == "__main__":
     surnames = load_surnames()
@@ -0,0 +1,161 @@
+import sys
+from array import array
+from bisect import bisect_left
+from collections import deque
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick オートマトン（純 Python）。
+    複数キーワードの完全一致を、入力テキスト 1 パスで全件検出する。
+
+        ac = KeywordAutomaton([("バカ", 0), ("アホ", 1)])
+        list(ac.iter_matches("バカとアホ"))  # => [(0, 2, 0), (3, 5, 1)]
+
+    ノードごとに dict を持つと 10 万語で数十 MiB になるので、遷移・失敗遷移・出力はすべて array で持つ。
+      - ノード番号は幅優先の順。ノード n の遷移は _chars / _targets の [_edge_start[n], _edge_start[n + 1])
+        （文字コード順に並んでいるので二分探索で引く）
+      - ノード n で終わるキーワードは _out_lengths / _payloads の [_out_start[n], _out_start[n + 1])
+    """
+    __slots__ = ("_edge_start", "_chars", "_targets", "_fail", "_link",
+                 "_out_start", "_out_lengths", "_payloads", "size")
+
+    def __init__(self, pairs=()):
+        """
+        :param pairs: (keyword, payload) のイテラブル。payload はマッチ時にそのまま返る
+                      （すべて int なら array で持つ）
+        """
+        # 同じキーワードの payload は渡された順に返すので、安定ソートでまとめる
+        items = sorted(((k, p) for k, p in pairs if k), key=lambda kp: kp[0])
+        keys = [k for k, _ in items]
+        self.size = len(items)
+
+        edge_start = array("I")
+        chars = array("I")
+        targets = array("I")
+        out_start = array("I", [0, 0])  # ルートは出力なし
+        out_lengths = array("I")
+        payloads = []
+
+        # ソート済みキーワードの区間 [lo, hi)（先頭 depth 文字が共通）= 1 ノード。幅優先で子を作る
+        queue = deque([(0, len(keys), 0)])
+        next_node = 1
+        while queue:
+            lo, hi, depth = queue.popleft()
+            edge_start.append(len(chars))
+            i = lo
+            while i < hi and len(keys[i]) == depth:
+                i += 1  # このノードで終わるキーワード（出力は親が登録済み）
+            while i < hi:
+                ch = keys[i][depth]
+                j = i + 1
+                while j < hi and keys[j][depth] == ch:
+                    j += 1
+                chars.append(ord(ch))
+                targets.append(next_node)
+                next_node += 1
+                k = i
+                while k < j and len(keys[k]) == depth + 1:
+                    out_lengths.append(depth + 1)
+                    payloads.append(items[k][1])
+                    k += 1
+                out_start.append(len(out_lengths))
+                queue.append((i, j, depth + 1))
+                i = j
+        edge_start.append(len(chars))
+        del items, keys
+
+        self._edge_start, self._chars, self._targets = edge_start, chars, targets
+        self._out_start, self._out_lengths = out_start, out_lengths
+        if all(type(p) is int for p in payloads):
+            payloads = array("q", payloads)
+        self._payloads = payloads
+        self._build(next_node)
+
+    def _goto(self, node, code):
+        lo, hi = self._edge_start[node], self._edge_start[node + 1]
+        j = bisect_left(self._chars, code, lo, hi)
+        return self._targets[j] if j < hi and self._chars[j] == code else 0
+
+    def _build(self, n):
+        # ノード番号が幅優先の順なので、番号順に見れば失敗遷移先は必ず計算済み
+        fail = array("I", [0]) * n
+        link = array("I", [0]) * n
+        edge_start, chars, targets, out_start = self._edge_start, self._chars, self._targets, self._out_start
+        for node in range(n):
+            for e in range(edge_start[node], edge_start[node + 1]):
+                child = targets[e]
+                if node:
+                    code = chars[e]
+                    f = fail[node]
+                    while True:
+                        target = self._goto(f, code)
+                        if target or not f:
+                            break
+                        f = fail[f]
+                    fail[child] = target
+                fc = fail[child]
+                link[child] = fc if out_start[fc] != out_start[fc + 1] else link[fc]
+        self._fail, self._link = fail, link
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+    def nbytes(self):
+        """
+        おおよそのメモリ使用量（payload が int 以外ならその中身は含まない）
+        """
+        return sum(sys.getsizeof(getattr(self, name)) for name in self.__slots__ if name != "size")
+
+    def iter_matches(self, text):
+        """
+        (start, end, payload) を終端位置順に返す（重なりも含めて全件）
+        """
+        edge_start, chars, targets = self._edge_start, self._chars, self._targets
+        fail, link, out_start, out_lengths, payloads = (
+            self._fail, self._link, self._out_start, self._out_lengths, self._payloads
+        )
+        node = 0
+        for i, ch in enumerate(text):
+            code = ord(ch)
+            while True:
+                lo, hi = edge_start[node], edge_start[node + 1]
+                if lo != hi:
+                    j = bisect_left(chars, code, lo, hi)
+                    if j < hi and chars[j] == code:
+                        node = targets[j]
+                        break
+                if not node:
+                    break
+                node = fail[node]
+            hit = node if out_start[node] != out_start[node + 1] else link[node]
+            while hit:
+                end = i + 1
+                for k in range(out_start[hit], out_start[hit + 1]):
+                    yield (end - out_lengths[k], end, payloads[k])
+                hit = link[hit]
+
+    def search(self, text):
+        """
+        最初に見つかったマッチ（なければ None）。判定だけ欲しいとき用
+        """
+        for match in self.iter_matches(text):
+            return match
+        return None
+
+
+def merge_spans(spans):
+    """
+    重なり・隣接する (start, end) をまとめてソート済みリストにする
+    """
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(s, e) for s, e in merged]
@@ -0,0 +1,233 @@
+import sys
+from array import array
+
+# =========================================
+# OFFENSIVE_LIST のコンパクト表現
+# =========================================
+# [{"original": ..., "norm": ..., "tokens": [...]}] を 1 エントリ 1 dict で持つと、
+# dict + list + 文字列オブジェクトで 1 件あたり数百バイトになり、gunicorn のワーカーごとに複製される。
+# ここでは列指向で持つ:
+#   - original / norm : 1 本の連結文字列 + array の (開始, 終了) オフセット（norm == original なら同じ区間を指す）
+#   - tokens          : lemma を id に intern し、array の id 列 + エントリごとのオフセット
+# イテレーションや添字アクセスでは、dict と同じキーで読める OffensiveEntry を都度作って返す。
+
+
+class OffensiveEntry:
+    """
+    1 エントリ分のビュー。entry["original"] のように dict 互換で読める
+    """
+    __slots__ = ("original", "norm", "tokens")
+
+    def __init__(self, original, norm, tokens):
+        self.original = original
+        self.norm = norm
+        self.tokens = tokens
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __repr__(self):
+        return f"<OffensiveEntry original={self.original!r} norm={self.norm!r} tokens={self.tokens!r}>"
+
+
+class NormView:
+    """
+    store.norm(i) の読み取り専用シーケンス。rapidfuzz.process にそのまま渡せる（文字列は都度切り出す）
+    """
+    __slots__ = ("_store",)
+
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return len(self._store)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self._store)
+        if not 0 <= i < len(self._store):
+            raise IndexError(i)
+        return self._store.norm(i)
+
+    def __iter__(self):
+        norm = self._store.norm
+        for i in range(len(self._store)):
+            yield norm(i)
+
+
+class CompactOffensiveList:
+    def __init__(self):
+        self._buffer = ""
+        self._original_spans = array("I")   # [start0, end0, start1, end1, ...]
+        self._norm_spans = array("I")
+        self.lemmas = []                    # lemma id → 文字列
+        self._lemma_ids = {}                # 文字列 → lemma id
+        self._token_ids = array("I")
+        self._token_offsets = array("I", [0])
+
+    @classmethod
+    def from_entries(cls, entries):
+        """
+        {"original", "norm", "tokens"} を持つエントリのイテラブル（ジェネレータ可）から作る
+        """
+        store = cls()
+        parts = []
+        pos = 0
+        for item in entries:
+            original, norm = item["original"], item["norm"]
+            store._original_spans.extend((pos, pos + len(original)))
+            parts.append(original)
+            pos += len(original)
+            if norm == original:
+                store._norm_spans.extend(store._original_spans[-2:])
+            else:
+                store._norm_spans.extend((pos, pos + len(norm)))
+                parts.append(norm)
+                pos += len(norm)
+
+            for lemma in item["tokens"]:
+                store._token_ids.append(store._intern(lemma))
+            store._token_offsets.append(len(store._token_ids))
+        store._buffer = "".join(parts)
+        return store
+
+    def _intern(self, lemma):
+        lemma_id = self._lemma_ids.get(lemma)
+        if lemma_id is None:
+            lemma_id = len(self.lemmas)
+            self.lemmas.append(sys.intern(lemma))
+            self._lemma_ids[lemma] = lemma_id
+        return lemma_id
+
+    def __len__(self):
+        return len(self._token_offsets) - 1
+
+    def original(self, i):
+        return self._buffer[self._original_spans[2 * i]:self._original_spans[2 * i + 1]]
+
+    def norm(self, i):
+        return self._buffer[self._norm_spans[2 * i]:self._norm_spans[2 * i + 1]]
+
+    @property
+    def norms(self):
+        """正規化形の一覧（コピーせず連結文字列から読む）"""
+        return NormView(self)
+
+    def token_ids(self, i):
+        return self._token_ids[self._token_offsets[i]:self._token_offsets[i + 1]]
+
+    def tokens(self, i):
+        lemmas = self.lemmas
+        return [lemmas[t] for t in self.token_ids(i)]
+
+    def lemma_id(self, lemma):
+        """辞書に出てこない lemma なら None"""
+        return self._lemma_ids.get(lemma)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return OffensiveEntry(self.original(i), self.norm(i), self.tokens(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield OffensiveEntry(self.original(i), self.norm(i), self.tokens(i))
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def nbytes(self):
+        """
+        おおよそのメモリ使用量（連結文字列 + オフセット配列 + lemma 表）
+        """
+        arrays = (self._original_spans, self._norm_spans, self._token_ids, self._token_offsets)
+        return (
+            sys.getsizeof(self._buffer)
+            + sum(sys.getsizeof(a) for a in arrays)
+            + sys.getsizeof(self.lemmas) + sum(sys.getsizeof(l) for l in self.lemmas)
+            + sys.getsizeof(self._lemma_ids)
+        )
+
+
+def _deep_sizeof(obj, seen=None):
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(k, seen) + _deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_deep_sizeof(v, seen) for v in obj)
+    elif isinstance(obj, CompactOffensiveList):
+        size += _deep_sizeof(obj.__dict__, seen)
+    return size
+
+
+def _synthetic_entries(n, seed=0):
+    import random
+    rng = random.Random(seed)
+    katakana = [chr(c) for c in range(0x30A1, 0x30F7)]
+    kanji = [chr(c) for c in range(0x4E00, 0x4E00 + 2000)]
+    lemmas = ["".join(rng.choice(katakana + kanji) for _ in range(rng.randint(1, 3))) for _ in range(n // 4 + 1)]
+    for _ in range(n):
+        tokens = [rng.choice(lemmas) for _ in range(rng.randint(1, 3))]
+        norm = "".join(tokens)
+        original = norm if rng.random() < 0.6 else norm + rng.choice(kanji)
+        yield {"original": original, "norm": norm, "tokens": tokens}
+
+
+def _fresh(entries):
+    # 実際のロード時と同じく、文字列はエントリごとに別オブジェクトにする
+    def copy(text):
+        return text.encode("utf-8").decode("utf-8")
+    for e in entries:
+        yield {"original": copy(e["original"]), "norm": copy(e["norm"]), "tokens": [copy(t) for t in e["tokens"]]}
+
+
+if __name__ == "__main__":
+    # メモリ比較: python -m models.offensive_store [件数 | offensive_words.json]
+    # ワーカーが実際に持つのは store と、その上に作る OffensiveMatcher（オートマトン・語彙索引）の両方なので、
+    # 従来の list[dict] と「CompactOffensiveList + OffensiveMatcher」を比べる
+    import tracemalloc
+    from models.text_evaluation import load_offensive_dict_with_tokens, OffensiveMatcher
+
+    arg = sys.argv[1] if len(sys.argv) > 1 else "100000"
+    if arg.isdigit():
+        source = list(_synthetic_entries(int(arg)))
+        label = f"synthetic x{arg}"
+    else:
+        source = load_offensive_dict_with_tokens(arg)
+        label = arg
+
+    tracemalloc.start()
+    as_dicts = list(_fresh(source))
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    compact = CompactOffensiveList.from_entries(_fresh(source))
+    compact_bytes = tracemalloc.get_traced_memory()[0]
+    matcher = OffensiveMatcher(compact)
+    total_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(compact) == len(as_dicts)
+    assert all(compact[i]["tokens"] == as_dicts[i]["tokens"] for i in range(0, len(compact), 997))
+
+    mib = 1024 * 1024
+    print(f"[{label}] {len(as_dicts)} 件, lemma {len(compact.lemmas)} 種")
+    print(f"  list[dict]                             : {dict_bytes / mib:8.2f} MiB (tracemalloc), "
+          f"{_deep_sizeof(as_dicts) / mib:8.2f} MiB (getsizeof)")
+    print(f"  CompactOffensiveList                   : {compact_bytes / mib:8.2f} MiB (tracemalloc), "
+          f"{compact.nbytes() / mib:8.2f} MiB (nbytes)")
+    print(f"  CompactOffensiveList + OffensiveMatcher: {total_bytes / mib:8.2f} MiB (tracemalloc, 構築中のピーク "
+          f"{peak_bytes / mib:.2f} MiB), {matcher.nbytes() / mib:8.2f} MiB (nbytes)")
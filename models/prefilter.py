@@ -0,0 +1,110 @@
+import re
+import math
+import base64
+import hashlib
+
+# =========================================
+# クライアント用プレフィルタ（Bloom filter）
+# =========================================
+# 辞書語（正規化済み・空白除去）の n-gram を Bloom filter に入れて配信する。
+# 平文の語は含まないので、static/detector.js はこれで「明らかに問題なし」を即時判定し、
+# ヒットの可能性があるときだけサーバーに問い合わせる。
+#   - 語の長さが MAX_GRAM 以下 → 語そのものを登録
+#   - それより長い語          → 全 MAX_GRAM-gram を登録
+# クライアントは入力の長さ 1〜MAX_GRAM の部分文字列をすべて引き、1 つでも当たれば「要確認」。
+# 入力自体が MAX_GRAM 以下の短文は辞書語の一部と部分一致しうるので、常にサーバーに回す。
+# ハッシュ計算は detector.js と完全に一致させること。
+
+PREFILTER_FORMAT = 1
+MAX_GRAM = 3
+FALSE_POSITIVE_RATE = 0.01
+
+_FNV_OFFSET = 0x811C9DC5
+_FNV_PRIME = 0x01000193
+_WHITESPACE = re.compile(r"\s+")
+
+
+def compact(text: str) -> str:
+    """空白を取り除く（辞書語・入力の両方に同じ処理をする）"""
+    return _WHITESPACE.sub("", text)
+
+
+def _fnv1a(text: str, h: int) -> int:
+    """FNV-1a 32bit（コードポイント単位）。JS 側は codePointAt で同じ計算をする"""
+    for ch in text:
+        h = ((h ^ ord(ch)) * _FNV_PRIME) & 0xFFFFFFFF
+    return h
+
+
+def iter_grams(word: str, n: int = MAX_GRAM):
+    word = compact(word)
+    if not word:
+        return
+    if len(word) <= n:
+        yield word
+        return
+    for i in range(len(word) - n + 1):
+        yield word[i:i + n]
+
+
+class BloomFilter:
+    """
+    double hashing 方式: index_i = (h1 + i * h2) mod m
+    h1 / h2 は salt + "\\x00" / salt + "\\x01" を前置した FNV-1a
+    """
+    def __init__(self, capacity: int, false_positive_rate: float = FALSE_POSITIVE_RATE, salt: str = ""):
+        capacity = max(capacity, 1)
+        m = int(math.ceil(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self.m = max(64, (m + 7) // 8 * 8)
+        self.k = max(1, int(round(self.m / capacity * math.log(2))))
+        self.salt = salt
+        self.bits = bytearray(self.m // 8)
+        self._seed1 = _fnv1a(salt + "\x00", _FNV_OFFSET)
+        self._seed2 = _fnv1a(salt + "\x01", _FNV_OFFSET)
+
+    def _indexes(self, item: str):
+        h1 = _fnv1a(item, self._seed1)
+        h2 = _fnv1a(item, self._seed2) | 1
+        m = self.m
+        for i in range(self.k):
+            yield (h1 + i * h2) % m
+
+    def add(self, item: str):
+        for idx in self._indexes(item):
+            self.bits[idx >> 3] |= 1 << (idx & 7)
+
+    def __contains__(self, item: str):
+        bits = self.bits
+        return all(bits[idx >> 3] & (1 << (idx & 7)) for idx in self._indexes(item))
+
+
+def build_prefilter(words, version: str, false_positive_rate: float = FALSE_POSITIVE_RATE) -> dict:
+    """
+    :param words: 正規化済みの語のイテラブル（辞書語 + 固定キーワードなど）
+    :param version: 辞書バージョン（OffensiveMatcher.version）。salt にも使う
+    :return: /prefilter.json でそのまま返す dict
+    """
+    grams = set()
+    for word in words:
+        grams.update(iter_grams(word))
+
+    salt = version[:16]
+    bloom = BloomFilter(len(grams), false_positive_rate, salt=salt)
+    for gram in grams:
+        bloom.add(gram)
+
+    bits = bytes(bloom.bits)
+    digest = hashlib.sha256(
+        f"{PREFILTER_FORMAT}:{bloom.m}:{bloom.k}:{MAX_GRAM}:{salt}:".encode("utf-8") + bits
+    ).hexdigest()
+    return {
+        "format": PREFILTER_FORMAT,
+        "version": version,
+        "hash": digest,
+        "m": bloom.m,
+        "k": bloom.k,
+        "n": MAX_GRAM,
+        "salt": salt,
+        "count": len(grams),
+        "bits": base64.b64encode(bits).decode("ascii"),
+    }
@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+
+try:
+    import redis  # 任意（RESULT_STORE=redis のときだけ必要）
+except ImportError:
+    redis = None
+
+# =========================================
+# ワーカー間で共有する判定結果ストア
+# =========================================
+# evaluate_text() のプロセス内キャッシュ（_eval_cache / cached_tokenize）はワーカーごとなので、
+# 同じ文章がワーカーの数だけ評価され、再起動すると空になる。
+# ここでは「正規化済みテキスト + 辞書バージョン」をキーに (判定, detail) を共有する。
+#   - SQLiteResultStore : 同一ノードの全ワーカーで共有（WAL モード。再起動後も残る）
+#   - RedisResultStore  : 複数ノードで共有（Redis 互換のサーバーならどれでも可）
+#
+# 環境変数:
+#   RESULT_STORE        "sqlite" / "redis"（未設定なら使わない）
+#   RESULT_STORE_PATH   sqlite のファイル（既定: DATA_DIR/results.sqlite3）
+#   RESULT_STORE_URL    redis の URL（既定: redis://localhost:6379/0）
+#   RESULT_STORE_TTL    有効期限（秒、既定 7 日）
+
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 500000
+
+
+def result_key(norm_text: str, version: str) -> str:
+    return hashlib.sha256(f"{version}\x00{norm_text}".encode("utf-8")).hexdigest()
+
+
+class SQLiteResultStore:
+    _PRUNE_PROBABILITY = 0.001  # set 1000 回に 1 回くらい期限切れ・上限超過分を掃除する
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS results "
+            "(key TEXT PRIMARY KEY, judgement TEXT NOT NULL, detail TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT judgement, detail, created FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[2] < time.time() - self.ttl:
+            return None
+        return (row[0], row[1])
+
+    def set(self, key, value):
+        judgement, detail = value
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO results (key, judgement, detail, created) VALUES (?, ?, ?, ?)",
+            (key, judgement, detail, time.time()),
+        )
+        if random.random() < self._PRUNE_PROBABILITY:
+            self.prune()
+
+    def prune(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM results WHERE created < ?", (time.time() - self.ttl,))
+        (count,) = conn.execute("SELECT COUNT(*) FROM results").fetchone()
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY created LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+
+class RedisResultStore:
+    def __init__(self, url, ttl=DEFAULT_TTL, prefix="mojitap:result:"):
+        if redis is None:
+            raise RuntimeError("RESULT_STORE=redis には redis パッケージが必要です（pip install redis）")
+        self.client = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        self.ttl = int(ttl)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        judgement, detail = json.loads(raw)
+        return (judgement, detail)
+
+    def set(self, key, value):
+        self.client.setex(self.prefix + key, self.ttl, json.dumps(list(value), ensure_ascii=False))
+
+
+def create_result_store(kind=None, data_dir=None):
+    """
+    環境変数から結果ストアを作る。未設定なら None（プロセス内キャッシュのみ）
+    """
+    kind = kind if kind is not None else os.getenv("RESULT_STORE", "")
+    ttl = float(os.getenv("RESULT_STORE_TTL", DEFAULT_TTL))
+    if not kind:
+        return None
+    if kind == "sqlite":
+        path = os.getenv("RESULT_STORE_PATH") or os.path.join(
+            data_dir or os.path.join(os.path.dirname(__file__), "..", "data"), "results.sqlite3"
+        )
+        return SQLiteResultStore(path, ttl=ttl)
+    if kind == "redis":
+        return RedisResultStore(os.getenv("RESULT_STORE_URL", "redis://localhost:6379/0"), ttl=ttl)
+    raise ValueError(f"unknown RESULT_STORE: {kind}")
@@ -0,0 +1,197 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import and_, or_, func
+
+from extensions import db
+from .custom_dictionary import (
+    CustomDictionaryEntry, OrganizationMember,
+    OWNER_USER, OWNER_ORGANIZATION, KIND_OFFENSIVE, KIND_WHITELIST,
+)
+from .offensive_store import CompactOffensiveList
+from .text_evaluation import (
+    OffensiveMatcher, WhitelistMatcher, LayeredOffensiveMatcher, LayeredWhitelist, iter_offensive_entries,
+)
+
+# =========================================
+# テナント（ユーザー / 組織）ごとの追加辞書
+# =========================================
+# グローバル辞書（OFFENSIVE_LIST / WHITELIST_MATCHER）はワーカー起動時に 1 回だけコンパイルする。
+# テナントの追加分は、持ち主（ユーザー / 組織）ごとに初回利用時にだけコンパイルし、
+# グローバルのマッチャーの上に重ねて使う（LayeredOffensiveMatcher / LayeredWhitelist）。
+#   - 組織の辞書は所属ユーザー全員で 1 つのコンパイル結果を共有する
+#   - コンパイル結果はメモリ使用量（概算）の上限つき LRU に置く
+#   - 辞書が変わったかどうかは (件数, 最大 id, 最終追加時刻) で判定する（DB へは集計クエリ 1 本）
+#
+# 環境変数:
+#   TENANT_MATCHER_CACHE_MB    コンパイル済みテナント辞書に使うメモリの上限（MiB、既定 64）
+#   TENANT_DICTIONARY_TTL      辞書バージョンを DB に問い合わせ直す間隔（秒、既定 10）
+#                              同じワーカーでの変更は即時、他のワーカーへはこの間隔で反映される
+
+DEFAULT_CACHE_MB = 64
+DEFAULT_VERSION_TTL = 10.0
+MAX_VERSION_ENTRIES = 10000   # ユーザー → 辞書バージョンの保持数
+
+
+class CompiledOverlay:
+    """1 つの持ち主の追加辞書をコンパイルしたもの（どちらかの種類が無ければ None）"""
+    __slots__ = ("version", "offensive", "whitelist", "nbytes")
+
+    def __init__(self, version, offensive, whitelist):
+        self.version = version
+        self.offensive = offensive
+        self.whitelist = whitelist
+        self.nbytes = (offensive.nbytes() if offensive else 0) + (whitelist.nbytes() if whitelist else 0)
+
+
+def compile_overlay(version, entries):
+    """
+    :param entries: [(kind, word), ...]
+    """
+    offensive_words = sorted({word for kind, word in entries if kind == KIND_OFFENSIVE})
+    whitelist_words = sorted({word for kind, word in entries if kind == KIND_WHITELIST})
+    offensive = None
+    if offensive_words:
+        offensive = OffensiveMatcher(CompactOffensiveList.from_entries(iter_offensive_entries(offensive_words)))
+    whitelist = WhitelistMatcher(whitelist_words) if whitelist_words else None
+    return CompiledOverlay(version, offensive, whitelist)
+
+
+class TenantMatcherCache:
+    def __init__(self, max_bytes=DEFAULT_CACHE_MB * 1024 * 1024, version_ttl=DEFAULT_VERSION_TTL):
+        self.max_bytes = max_bytes
+        self.version_ttl = version_ttl
+        self._overlays = OrderedDict()   # (owner_type, owner_id) → CompiledOverlay
+        self._versions = OrderedDict()   # user_id → (確認時刻, {(owner_type, owner_id): version})
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_bytes=int(float(os.getenv("TENANT_MATCHER_CACHE_MB", DEFAULT_CACHE_MB)) * 1024 * 1024),
+            version_ttl=float(os.getenv("TENANT_DICTIONARY_TTL", DEFAULT_VERSION_TTL)),
+        )
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._overlays)
+
+    # ---- コンパイル済み辞書の LRU ----
+    def get(self, owner, version):
+        with self._lock:
+            overlay = self._overlays.get(owner)
+            if overlay is None or overlay.version != version:
+                return None
+            self._overlays.move_to_end(owner)
+            return overlay
+
+    def put(self, owner, overlay):
+        with self._lock:
+            old = self._overlays.pop(owner, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._overlays[owner] = overlay
+            self._bytes += overlay.nbytes
+            # 上限を超えたら古いものから捨てる（今入れたものは残す）
+            while self._bytes > self.max_bytes and len(self._overlays) > 1:
+                _, evicted = self._overlays.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def invalidate(self, owner):
+        """
+        持ち主の辞書を変更したときに呼ぶ（このワーカーでは次のリクエストから反映）
+        """
+        with self._lock:
+            old = self._overlays.pop(owner, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            if owner[0] == OWNER_USER:
+                self._versions.pop(owner[1], None)
+            else:
+                self._versions.clear()  # 組織の変更はメンバー全員に効く
+
+    # ---- ユーザー → 辞書バージョン（TTL つき） ----
+    def versions_for(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._versions.get(user_id)
+            if cached is not None and cached[0] > now - self.version_ttl:
+                self._versions.move_to_end(user_id)
+                return cached[1]
+        versions = _query_versions(user_id)
+        with self._lock:
+            self._versions[user_id] = (now, versions)
+            while len(self._versions) > MAX_VERSION_ENTRIES:
+                self._versions.popitem(last=False)
+        return versions
+
+
+def _owner_filter(user_id):
+    organizations = db.session.query(OrganizationMember.organization_id).filter(
+        OrganizationMember.user_id == user_id
+    )
+    return or_(
+        and_(CustomDictionaryEntry.owner_type == OWNER_USER, CustomDictionaryEntry.owner_id == user_id),
+        and_(CustomDictionaryEntry.owner_type == OWNER_ORGANIZATION, CustomDictionaryEntry.owner_id.in_(organizations)),
+    )
+
+
+def _query_versions(user_id):
+    """
+    :return: {(owner_type, owner_id): "件数:最大id:最終追加時刻"}（追加辞書を持つ持ち主だけ）
+    """
+    E = CustomDictionaryEntry
+    rows = (
+        db.session.query(E.owner_type, E.owner_id, func.count(E.id), func.max(E.id), func.max(E.created_at))
+        .filter(_owner_filter(user_id))
+        .group_by(E.owner_type, E.owner_id)
+        .all()
+    )
+    return {(owner_type, owner_id): f"{count}:{max_id}:{latest}" for owner_type, owner_id, count, max_id, latest in rows}
+
+
+def _load_entries(owner):
+    owner_type, owner_id = owner
+    rows = (
+        db.session.query(CustomDictionaryEntry.kind, CustomDictionaryEntry.word)
+        .filter_by(owner_type=owner_type, owner_id=owner_id)
+        .all()
+    )
+    return [(kind, word) for kind, word in rows]
+
+
+def get_tenant_matchers(user_id, offensive_list, whitelist, cache):
+    """
+    ユーザーに効く辞書（グローバル + 所属組織 + 本人）を返す。追加辞書が無ければグローバルをそのまま返す
+    :return: (offensive_list または LayeredOffensiveMatcher, whitelist または LayeredWhitelist)
+    """
+    versions = cache.versions_for(user_id)
+    if not versions:
+        return offensive_list, whitelist
+
+    # 組織 → 本人の順に重ねる（順番を固定して、重ねた辞書のバージョンが毎回同じになるようにする）
+    # 除外語はどの層のものでも全層の辞書語に効く
+    owners = sorted(versions, key=lambda owner: (owner[0] == OWNER_USER, owner[1]))
+    offensive_layers = [offensive_list]
+    whitelist_layers = [whitelist]
+    for owner in owners:
+        overlay = cache.get(owner, versions[owner])
+        if overlay is None:
+            overlay = compile_overlay(versions[owner], _load_entries(owner))
+            cache.put(owner, overlay)
+        if overlay.offensive is not None:
+            offensive_layers.append(overlay.offensive)
+        if overlay.whitelist is not None:
+            whitelist_layers.append(overlay.whitelist)
+
+    if len(offensive_layers) > 1:
+        offensive_list = LayeredOffensiveMatcher(offensive_layers)
+    if len(whitelist_layers) > 1:
+        whitelist = LayeredWhitelist(whitelist_layers)
+    return offensive_list, whitelist
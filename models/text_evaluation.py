@@ -1,16 +1,25 @@
 import os
+import sys
 import json
 import re
+import hashlib
+import threading
+from array import array
 
 from collections import OrderedDict  # キャッシュ管理用
 from functools import lru_cache
 import spacy
 from spacy.lang.ja import Japanese
-from rapidfuzz import fuzz
+from rapidfuzz import fuzz, process
 import jaconv
 
+from .matcher import KeywordAutomaton, merge_spans
+from .prefilter import build_prefilter
+from .offensive_store import CompactOffensiveList
+from .result_store import result_key
+
 # あなたの環境で苗字をロードする関数（相対 or 絶対インポートに合わせて調整してください）
-from .load_surnames import load_surnames
+from .load_surnames import load_surnames, load_surname_readings
 
 # 形態素解析のキャッシュ
 nlp = spacy.load("ja_core_news_sm")  # 事前にロード（1回だけ）
@@ -20,8 +29,11 @@ def cached_tokenize(text):
     doc = nlp(text)
     return [token.lemma_ for token in doc]
 
-# 簡易キャッシュ（メモリに保存）: テキスト → 判定結果
-_eval_cache = {}
+# 簡易キャッシュ（メモリに保存）: (辞書バージョン, テキスト) → 判定結果
+#   テナントごと・辞書の編集ごとにバージョンが変わるので、件数の上限つき LRU にする
+EVAL_CACHE_SIZE = 10000
+_eval_cache = OrderedDict()
+_eval_cache_lock = threading.Lock()
 
 # =========================================
 # A) ユーティリティ関数
@@ -54,12 +66,13 @@ def tokenize_and_lemmatize(text: str):
 # =========================================
 # B) offensive_words.json のロード（token化付き）
 # =========================================
-def load_offensive_dict_with_tokens(json_path="offensive_words.json"):
+def load_offensive_dict_with_tokens(json_path="offensive_words.json", compact=False):
     """
     1) JSON をロード
     2) "offensive" キーのリストを取り出し
     3) 各ワードをトークン化
     4) [{"original": w, "norm": w_norm, "tokens": [...]}] を返す
+       compact=True なら同じ内容を CompactOffensiveList（列指向・lemma intern 済み）で返す
     """
     if not os.path.exists(json_path):
         raise FileNotFoundError(f"{json_path} が見つかりません。")
@@ -68,16 +81,24 @@ def load_offensive_dict_with_tokens(json_path="offensive_words.json"):
         raw_data = json.load(f)
 
     words = raw_data.get("offensive", [])
-    results = []
+
+    if compact:
+        return CompactOffensiveList.from_entries(iter_offensive_entries(words))
+    return list(iter_offensive_entries(words))
+
+def iter_offensive_entries(words):
+    """
+    語の並び → {"original": w, "norm": w_norm, "tokens": [...]} のジェネレータ
+    （offensive_words.json とテナント辞書の両方で使う）
+    """
     for w in words:
         w_norm = normalize_text(w)
         w_tokens = tokenize_and_lemmatize(w_norm)
-        results.append({
+        yield {
             "original": w,
             "norm": w_norm,
             "tokens": w_tokens
-        })
-    return results
+        }
 
 # =========================================
 # C) whitelist.json のロード（set で保持）
@@ -93,6 +114,95 @@ def load_whitelist(json_path="data/whitelist.json"):
         data = json.load(f)
     return set(data)
 
+# ホワイトリストの span を塗りつぶす文字
+#   - 前後の語がくっついて新しい語にならないよう、spaCy が空白として扱う文字にする
+#   - 辞書の語は 1 行なので、完全一致・ファジーのどちらでも塗りつぶし位置が辞書中の空白と揃わない
+MASK_CHAR = "\n"
+
+class WhitelistMatcher:
+    """
+    ホワイトリストをコンパイルしたもの。
+      - 正規化済みの入力からホワイトリスト語の span を 1 パスで検出し、塗りつぶす
+      - `word in matcher` で従来の set と同じように使える（原文 / 正規化形のどちらでも可）
+    """
+    def __init__(self, words=()):
+        self.words = frozenset(words)
+        self.norms = frozenset(normalize_text(w) for w in self.words)
+        self.automaton = KeywordAutomaton((n, None) for n in self.norms)
+        self.version = hashlib.sha256("\n".join(sorted(self.norms)).encode("utf-8")).hexdigest()
+
+    def __contains__(self, word):
+        return word in self.words or word in self.norms
+
+    def __len__(self):
+        return len(self.words)
+
+    def find_spans(self, norm_text: str):
+        """
+        正規化済みテキスト中のホワイトリスト span（重なりはまとめる）
+        """
+        if not self.automaton:
+            return []
+        return merge_spans((start, end) for start, end, _ in self.automaton.iter_matches(norm_text))
+
+    def nbytes(self) -> int:
+        """
+        おおよそのメモリ使用量（テナント辞書キャッシュの追い出し判定用）
+        """
+        return (
+            self.automaton.nbytes()
+            + sum(sys.getsizeof(w) for w in self.words) + sys.getsizeof(self.words)
+            + sum(sys.getsizeof(n) for n in self.norms) + sys.getsizeof(self.norms)
+        )
+
+    def mask(self, norm_text: str) -> str:
+        """
+        ホワイトリスト span を MASK_CHAR で置き換えたテキストを返す
+        """
+        spans = self.find_spans(norm_text)
+        if not spans:
+            return norm_text
+        parts = []
+        pos = 0
+        for start, end in spans:
+            parts.append(norm_text[pos:start])
+            parts.append(MASK_CHAR)
+            pos = end
+        parts.append(norm_text[pos:])
+        return "".join(parts)
+
+class LayeredWhitelist(WhitelistMatcher):
+    """
+    複数の WhitelistMatcher を重ねたもの（グローバル + テナントの除外語）。
+    各層は個別にコンパイル済みのものを使い回し、span は全層の結果をまとめる
+    """
+    def __init__(self, layers):
+        self.layers = tuple(compile_whitelist(layer) for layer in layers)
+        self.version = hashlib.sha256(
+            "\n".join(layer.version for layer in self.layers).encode("utf-8")
+        ).hexdigest()
+
+    def __contains__(self, word):
+        return any(word in layer for layer in self.layers)
+
+    def __len__(self):
+        return sum(len(layer) for layer in self.layers)
+
+    def nbytes(self) -> int:
+        return 0  # 各層の持ち主が数える
+
+    def find_spans(self, norm_text: str):
+        spans = [span for layer in self.layers for span in layer.find_spans(norm_text)]
+        return merge_spans(spans) if spans else []
+
+def compile_whitelist(whitelist) -> WhitelistMatcher:
+    """
+    set / list / WhitelistMatcher のいずれでも受け取り、WhitelistMatcher にして返す
+    """
+    if isinstance(whitelist, WhitelistMatcher):
+        return whitelist
+    return WhitelistMatcher(whitelist or ())
+
 # =========================================
 # D) 個別ロジック（例: 個人攻撃 + 犯罪組織）
 # =========================================
@@ -107,105 +217,501 @@ def detect_personal_accusation(text: str) -> bool:
     return bool(re.search(pattern, norm))
 
 # =========================================
-# E) メインの判定ロジック
+# E) 辞書のコンパイル（完全一致オートマトン + トークン索引 + ファジー用配列）
+# =========================================
+class OffensiveMatcher:
+    """
+    offensive_list を判定用にコンパイルしたもの。
+      - store       : CompactOffensiveList（原文・lemma id はここから引く）
+      - automaton   : 正規化形の完全一致（1 パス）
+      - 語彙索引    : lemma id → 辞書エントリ番号（各エントリは最も出現頻度の低い lemma の下に 1 回だけ登録）。
+                      candidates(lemma id) で引く。lemma id 順のオフセット配列 + エントリ番号の配列で持つ
+      - norms       : rapidfuzz.process にそのまま渡すファジー用シーケンス（store の連結文字列から都度切り出す）
+    """
+    def __init__(self, offensive_list):
+        if isinstance(offensive_list, CompactOffensiveList):
+            self.store = offensive_list
+        else:
+            self.store = CompactOffensiveList.from_entries(offensive_list)
+        store = self.store
+        self.norms = store.norms
+
+        self.automaton = KeywordAutomaton((norm, i) for i, norm in enumerate(self.norms))
+
+        freq = {}
+        for i in range(len(store)):
+            for tid in set(store.token_ids(i)):
+                freq[tid] = freq.get(tid, 0) + 1
+        keys = array("i", [-1]) * len(store)
+        counts = array("I", [0]) * (len(store.lemmas) + 1)
+        for i in range(len(store)):
+            token_ids = store.token_ids(i)
+            if not token_ids:
+                continue  # 空トークンは何にでも subset 一致してしまうので対象外
+            keys[i] = key = min(token_ids, key=lambda t: (freq[t], t))
+            counts[key + 1] += 1
+        del freq
+        for tid in range(1, len(counts)):
+            counts[tid] += counts[tid - 1]
+        entries = array("I", [0]) * counts[-1]
+        fill = array("I", counts)
+        for i, key in enumerate(keys):
+            if key >= 0:
+                entries[fill[key]] = i
+                fill[key] += 1
+        self._index_offsets = counts
+        self._index_entries = entries
+
+        self._version = None
+
+    def __len__(self):
+        return len(self.store)
+
+    def candidates(self, lemma_id):
+        """
+        lemma_id の下に登録されたエントリ番号（token 段の候補）
+        """
+        return self._index_entries[self._index_offsets[lemma_id]:self._index_offsets[lemma_id + 1]]
+
+    @property
+    def layers(self):
+        return (self,)
+
+    @property
+    def version(self) -> str:
+        """
+        辞書バージョン（正規化形の内容から計算する sha256）
+        """
+        if self._version is None:
+            self._version = hashlib.sha256("\n".join(self.norms).encode("utf-8")).hexdigest()
+        return self._version
+
+    def nbytes(self) -> int:
+        """
+        おおよそのメモリ使用量（テナント辞書キャッシュの追い出し判定用）
+        """
+        return (
+            self.store.nbytes()
+            + self.automaton.nbytes()
+            + sys.getsizeof(self._index_offsets) + sys.getsizeof(self._index_entries)
+        )
+
+class LayeredOffensiveMatcher:
+    """
+    複数の OffensiveMatcher を重ねたもの（グローバル辞書 + テナント辞書）。
+    各層は個別にコンパイル済みのものを使い回すので、テナントごとにグローバル辞書を作り直さない
+    """
+    def __init__(self, layers):
+        self.layers = tuple(get_offensive_matcher(layer) for layer in layers)
+        self.version = hashlib.sha256(
+            "\n".join(layer.version for layer in self.layers).encode("utf-8")
+        ).hexdigest()
+
+    def __len__(self):
+        return sum(len(layer) for layer in self.layers)
+
+# offensive_list(list) → OffensiveMatcher のキャッシュ（id で引き、同一オブジェクトか確認する）
+_matcher_cache = {}
+
+def get_offensive_matcher(offensive_list) -> OffensiveMatcher:
+    if isinstance(offensive_list, (OffensiveMatcher, LayeredOffensiveMatcher)):
+        return offensive_list
+    cached = _matcher_cache.get(id(offensive_list))
+    if cached is not None and cached[0] is offensive_list:
+        return cached[1]
+    matcher = OffensiveMatcher(offensive_list)
+    _matcher_cache[id(offensive_list)] = (offensive_list, matcher)
+    return matcher
+
+# =========================================
+# F) メインの判定ロジック（安いステージから順に実行）
 # =========================================
-_eval_cache = {}
+STAGE_EXACT = "exact"   # オートマトンによる完全一致
+STAGE_TOKEN = "token"   # lemma の subset 一致
+STAGE_FUZZY = "fuzzy"   # fuzz.partial_ratio
+
+FUZZY_THRESHOLD = 85
+KEYWORD_THRESHOLD = 90
+
+_DEFAULT_DETAIL = "※この判定は約束できるものではありません。専門家にご相談ください。"
+
+# カテゴリ → (判定, detail)。並び順がそのまま判定の優先順位
+VERDICTS = OrderedDict([
+    ("personal_attack", ("⚠️ 個人攻撃の可能性あり", "※個人名と否定的な表現の組み合わせが検出されました。")),
+    ("offensive", ("⚠️ 一部の表現が問題の可能性", _DEFAULT_DETAIL)),
+    ("violence", ("⚠️ 暴力的表現あり", _DEFAULT_DETAIL)),
+    ("harassment", ("⚠️ ハラスメント表現あり", _DEFAULT_DETAIL)),
+    ("threat", ("⚠️ 脅迫表現あり", _DEFAULT_DETAIL)),
+])
+NO_PROBLEM = ("問題ありません", "")
+
+NEGATIVE_WORDS = ["きらい", "嫌い", "憎い"]
+_NEGATIVE_NORMS = [normalize_text(neg) for neg in NEGATIVE_WORDS]
+
+KEYWORD_CATEGORIES = OrderedDict([
+    ("violence", ["殺す", "死ね", "殴る", "蹴る", "刺す", "轢く", "焼く", "爆破", "死んでしまえ"]),
+    ("harassment", ["お前消えろ", "存在価値ない", "いらない人間", "死んだほうがいい", "社会のゴミ"]),
+    ("threat", ["晒す", "特定する", "ぶっ壊す", "復讐する", "燃やす", "呪う", "報復する"]),
+])
+
+# 読みで拾った苗字の直後に続いてよいもの（敬称・助詞）。これ以外のカタカナが続くなら長い語の一部とみなす
+_READING_SUFFIXES = (
+    "サン", "クン", "チャン", "サマ", "センセイ", "シ",
+    "ッテ", "ハ", "ガ", "ノ", "ヲ", "モ", "ト", "ニ", "ヘ", "ッテバ", "ナンテ",
+)
+
+def _is_kana(ch: str) -> bool:
+    return "ァ" <= ch <= "ヶ" or ch == "ー"
+
+def _overlaps_word(a: str, b: str) -> bool:
+    """
+    a と b が重なり得るか（片方がもう片方を含む、または 2 文字以上の接頭辞・接尾辞が一致する）
+    """
+    if a in b or b in a:
+        return True
+    for n in range(2, min(len(a), len(b))):
+        if a.endswith(b[:n]) or b.endswith(a[:n]):
+            return True
+    return False
+
+@lru_cache(maxsize=1)
+def _surname_data():
+    """
+    苗字の表記（正規化形）とカタカナ読みを 1 つのオートマトンにまとめる。
+    読みは update_offensive_words.py が pykakasi で事前計算したもので、実行時に kakasi は使わない。
+    否定語と重なる読み（喜来 → キライ など）は、否定語そのものを苗字と誤認するので入れない。
+    payload は (苗字, 読みでのヒットか)。戻り値は (オートマトン, 苗字データのバージョン)
+    以前はリクエスト毎に CSV を読み直していたので、1 回だけロードする
+    """
+    pairs = {}
+    for sn in load_surnames():
+        pairs[normalize_text(sn)] = (sn, False)
+    for sn, readings in load_surname_readings().items():
+        for reading in readings:
+            if any(_overlaps_word(reading, neg) for neg in _NEGATIVE_NORMS):
+                continue
+            pairs.setdefault(reading, (sn, True))  # 表記と同じ綴りの読みは表記を優先
+    return KeywordAutomaton(pairs.items()), _surname_version(pairs)
+
+def _surname_version(pairs) -> str:
+    """
+    読み込んだ苗字データ（表記・読み）のバージョン。共有ストアのキーに入れて、苗字の更新後に古い判定を使わない
+    """
+    digest = hashlib.sha256()
+    for form in sorted(pairs):
+        sn, is_reading = pairs[form]
+        digest.update(f"{form}\t{sn}\t{int(is_reading)}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+def _surname_automaton():
+    return _surname_data()[0]
+
+def _negative_spans(input_norm: str):
+    spans = []
+    for neg in _NEGATIVE_NORMS:
+        pos = input_norm.find(neg)
+        while pos != -1:
+            spans.append((pos, pos + len(neg)))
+            pos = input_norm.find(neg, pos + 1)
+    return spans
+
+def _reading_has_boundary(input_norm: str, start: int, end: int) -> bool:
+    """
+    かな読みのヒットは、カタカナの連なりの途中（ピーマンガ の マンガ など）なら捨てる。
+    左はカタカナ以外（または文頭）、右はカタカナ以外・敬称 / 助詞のいずれかで区切られていること。
+    否定語が直接続く場合（ミンナキライ など）は、普通の語との区別がつかないので区切りとみなさない
+    """
+    if start > 0 and _is_kana(input_norm[start - 1]):
+        return False
+    if end == len(input_norm) or not _is_kana(input_norm[end]):
+        return True
+    return input_norm.startswith(_READING_SUFFIXES, end)
+
+def _iter_surnames(input_norm: str):
+    """
+    入力中の苗字（表記 / 読み）を返す。否定語の span に重なるもの・境界の無い読みは除く
+    """
+    negative_spans = _negative_spans(input_norm)
+    for start, end, (sn, is_reading) in _surname_automaton().iter_matches(input_norm):
+        if any(start < neg_end and neg_start < end for neg_start, neg_end in negative_spans):
+            continue
+        if is_reading and not _reading_has_boundary(input_norm, start, end):
+            continue
+        yield sn
+
+def _match_surnames(input_norm: str, first_hit: bool):
+    """
+    正規化済み（カタカナ統一）の入力に対して、否定語 → 苗字（表記 / 読み）の順に当てる。
+    「やましたさんがきらい」「ヤマシタ 嫌い」のようなかな書きもここで拾う
+    """
+    # 否定語の方が圧倒的に少ないので先に確認し、無ければ苗字は見ない
+    if not any(neg in input_norm for neg in _NEGATIVE_NORMS):
+        return []
+    if first_hit:
+        sn = next(_iter_surnames(input_norm), None)
+        return [sn] if sn else []
+    return sorted(set(_iter_surnames(input_norm)))
+
+def _match_offensive(masked_norm: str, matcher, whitelist, first_hit: bool):
+    """
+    exact → token → fuzzy の順に辞書を当てる（層が複数あれば、各ステージで全層を見てから次へ進む）。
+    first_hit=True なら最初のヒットで打ち切る。
+    :return: [{"word": 原文, "stage": ステージ名, "score": スコア}, ...]
+    """
+    hits = []
+    seen = set()   # (層番号, エントリ番号)
+    found = set()  # 原文（同じ語が複数の層にあっても 1 回だけ）
+    layers = matcher.layers
+
+    def add(n, i, stage, score):
+        if (n, i) in seen:
+            return False
+        seen.add((n, i))
+        layer = layers[n]
+        original = layer.store.original(i)
+        if original in found or original in whitelist or layer.norms[i] in whitelist:
+            return False
+        found.add(original)
+        hits.append({"word": original, "stage": stage, "score": score})
+        return True
+
+    # (1) 完全一致: 入力 1 パス
+    for n, layer in enumerate(layers):
+        for _, _, i in layer.automaton.iter_matches(masked_norm):
+            if add(n, i, STAGE_EXACT, 100) and first_hit:
+                return hits
+
+    # (2) lemma の subset 一致: 入力の lemma から候補エントリだけを引く
+    lemmas = set(tokenize_and_lemmatize(masked_norm))
+    for n, layer in enumerate(layers):
+        store = layer.store
+        input_ids = {store.lemma_id(tok) for tok in lemmas}
+        input_ids.discard(None)  # 辞書に出てこない lemma
+        for tid in input_ids:
+            for i in layer.candidates(tid):
+                if (n, i) not in seen and all(t in input_ids for t in store.token_ids(i)):
+                    if add(n, i, STAGE_TOKEN, 100) and first_hit:
+                        return hits
+
+    # (3) ファジーマッチ: rapidfuzz にまとめて渡し、閾値未満は C 側で切り捨てる
+    for n, layer in enumerate(layers):
+        if not layer.norms:
+            continue
+        results = process.extract(
+            masked_norm, layer.norms,
+            scorer=fuzz.partial_ratio, score_cutoff=FUZZY_THRESHOLD, limit=None
+        )
+        for _, score, i in results:
+            if add(n, i, STAGE_FUZZY, score) and first_hit:
+                return hits
+
+    return hits
+
+def _match_keywords(input_norm: str, keywords):
+    return [kw for kw in keywords if fuzz.partial_ratio(kw, input_norm) >= KEYWORD_THRESHOLD]
+
+def run_pipeline(text: str, offensive_list, whitelist=None, mode: str = "first_hit") -> dict:
+    """
+    判定パイプライン本体。
+    :param mode: "first_hit" → 判定が確定した時点で終了 / "full" → 全ステージを実行して全ヒットを集める
+    :return: {"judgement", "detail", "categories": [...], "hits": [...], "surnames": [...], "keywords": {...}}
+    """
+    if mode not in ("first_hit", "full"):
+        raise ValueError(f"unknown mode: {mode}")
+    first_hit = mode == "first_hit"
+    whitelist = compile_whitelist(whitelist)
+    matcher = get_offensive_matcher(offensive_list)
+
+    report = {"categories": [], "hits": [], "surnames": [], "keywords": {}}
+
+    def finish():
+        categories = report["categories"]
+        report["judgement"], report["detail"] = VERDICTS[categories[0]] if categories else NO_PROBLEM
+        return report
+
+    input_norm = normalize_text(text)
+
+    # A) 個人名（表記・かな読み）+ 否定的な表現
+    surnames = _match_surnames(input_norm, first_hit)
+    if surnames:
+        report["surnames"] = surnames
+        report["categories"].append("personal_attack")
+        if first_hit:
+            return finish()
+
+    # B) offensive_list 判定（ホワイトリスト span を塗りつぶした残りだけが対象）
+    masked_norm = whitelist.mask(input_norm)
+    if masked_norm.strip():
+        hits = _match_offensive(masked_norm, matcher, whitelist, first_hit)
+        if hits:
+            print("[DEBUG] found_offensive =", [h["word"] for h in hits])
+            report["hits"] = hits
+            report["categories"].append("offensive")
+            if first_hit:
+                return finish()
+
+    # C) 暴力・ハラスメント・脅迫（固定キーワードのファジー判定）
+    for category, keywords in KEYWORD_CATEGORIES.items():
+        matched = _match_keywords(input_norm, keywords)
+        if matched:
+            report["keywords"][category] = matched
+            report["categories"].append(category)
+            if first_hit:
+                return finish()
+
+    return finish()
+
+def analyze_segment(text: str, offensive_list, whitelist=None) -> dict:
+    """
+    文書の 1 区間（文）ぶんの判定材料。文書全体の判定は combine_segments() で合成する（インクリメンタル判定用）
+    苗字と否定語は別々の文にあっても組み合わせになるので、区間ごとには有無だけを持つ
+    """
+    whitelist = compile_whitelist(whitelist)
+    matcher = get_offensive_matcher(offensive_list)
+    input_norm = normalize_text(text)
+
+    surname = next(_iter_surnames(input_norm), None)
+    masked_norm = whitelist.mask(input_norm)
+    hits = _match_offensive(masked_norm, matcher, whitelist, first_hit=True) if masked_norm.strip() else []
+    keywords = [
+        category for category, kws in KEYWORD_CATEGORIES.items()
+        if any(fuzz.partial_ratio(kw, input_norm) >= KEYWORD_THRESHOLD for kw in kws)
+    ]
+    return {
+        "surname": surname,
+        "negative": any(neg in input_norm for neg in _NEGATIVE_NORMS),
+        "hits": hits,
+        "keywords": keywords,
+    }
+
+def combine_segments(results) -> dict:
+    """
+    analyze_segment() の結果の並びから、run_pipeline() と同じ形の判定を作る
+    """
+    results = list(results)
+    report = {"categories": [], "hits": [], "surnames": [], "keywords": {}}
+
+    surnames = sorted({r["surname"] for r in results if r["surname"]})
+    if surnames and any(r["negative"] for r in results):
+        report["surnames"] = surnames
+        report["categories"].append("personal_attack")
+
+    hits = [h for r in results for h in r["hits"]]
+    if hits:
+        report["hits"] = hits
+        report["categories"].append("offensive")
+
+    for category in KEYWORD_CATEGORIES:
+        if any(category in r["keywords"] for r in results):
+            report["categories"].append(category)
+
+    categories = report["categories"]
+    report["judgement"], report["detail"] = VERDICTS[categories[0]] if categories else NO_PROBLEM
+    return report
+
+def build_client_prefilter(offensive_list) -> dict:
+    """
+    static/detector.js 向けのプレフィルタ（辞書語・否定語・固定キーワードの n-gram Bloom filter）
+    """
+    matcher = get_offensive_matcher(offensive_list)
+    words = list(matcher.norms)
+    for kw in NEGATIVE_WORDS + [kw for kws in KEYWORD_CATEGORIES.values() for kw in kws]:
+        words.append(kw)
+        words.append(normalize_text(kw))
+    return build_prefilter(words, matcher.version)
+
+def build_tenant_prefilter(offensive_list):
+    """
+    テナントの追加辞書ぶんだけのプレフィルタ（detector.js がグローバルのプレフィルタに重ねて使う）。
+    追加辞書が無ければ None
+    """
+    matcher = get_offensive_matcher(offensive_list)
+    overlays = matcher.layers[1:]
+    if not overlays:
+        return None
+    return build_prefilter([norm for layer in overlays for norm in layer.norms], matcher.version)
+
+# 判定ロジックを変えたら上げる（共有ストアの古い結果を使わないように）
+PIPELINE_VERSION = 1
+
+# ワーカー間で共有する結果ストア（models/result_store.py）。create_app() が set_result_store() で設定する
+_result_store = None
+
+def set_result_store(store):
+    global _result_store
+    _result_store = store
+
+def result_version(offensive_list, whitelist=None) -> str:
+    """
+    共有ストアのキーに使う辞書バージョン（判定ロジック + 辞書 + ホワイトリスト + 苗字データ）
+    """
+    matcher = get_offensive_matcher(offensive_list)
+    whitelist = compile_whitelist(whitelist)
+    surnames = _surname_data()[1]
+    return f"{PIPELINE_VERSION}:{matcher.version[:16]}:{whitelist.version[:16]}:{surnames[:16]}"
+
+def _eval_cache_get(key):
+    with _eval_cache_lock:
+        result = _eval_cache.get(key)
+        if result is not None:
+            _eval_cache.move_to_end(key)
+        return result
+
+def _eval_cache_put(key, result):
+    with _eval_cache_lock:
+        _eval_cache[key] = result
+        _eval_cache.move_to_end(key)
+        while len(_eval_cache) > EVAL_CACHE_SIZE:
+            _eval_cache.popitem(last=False)
 
 def evaluate_text(
     text: str,
-    offensive_list: list,  # [{"original":..., "norm":..., "tokens":[...]}]
-    whitelist: set = None
+    offensive_list,  # [{"original":..., "norm":..., "tokens":[...]}] / OffensiveMatcher / LayeredOffensiveMatcher
+    whitelist=None
 ):
     """
     :param text: 入力文字列
     :param offensive_list: 形態素解析済み辞書
-    :param whitelist: {"ありがとう", "愛してる", ...} のようなセット
+    :param whitelist: {"ありがとう", "愛してる", ...} のようなセット、または compile_whitelist() の結果
     :return: (判定, detail)
     """
-    if whitelist is None:
-        whitelist = set()
+    # 既に判定済みならキャッシュから返す（テナントごとに辞書が違うので、辞書バージョンもキーに含める）
+    whitelist = compile_whitelist(whitelist)
+    version = result_version(offensive_list, whitelist)
+    cache_key = (version, text)
+    cached = _eval_cache_get(cache_key)
+    if cached is not None:
+        return cached
 
-    # 既に判定済みならキャッシュから返す
-    if text in _eval_cache:
-        return _eval_cache[text]
-        
-    # A) 入力テキストを形態素解析
-    input_norm = normalize_text(text)
-    input_tokens = tokenize_and_lemmatize(input_norm)
-
-    # B) offensive_list 判定
-    found_offensive = []
-    for item in offensive_list:
-        dict_original = item["original"]
-        dict_norm = item["norm"]
-        dict_tokens = item["tokens"]
-
-        # ======================
-        # (1) 既存の subset チェック
-        # ======================
-        if set(dict_tokens).issubset(set(input_tokens)):
-            # ホワイトリストチェック
-            if dict_original in whitelist or dict_norm in whitelist:
-                print(f"✅ ホワイトリスト除外: {dict_original}")
-                continue
-            found_offensive.append(dict_original)
-            print("[DEBUG] found_offensive =", found_offensive)
-
-        # ======================
-        # (2) ファジーマッチの追加
-        # ======================
-        score = fuzz.partial_ratio(dict_norm, input_norm)  # 入力全体 vs. 辞書単語
-        if score >= 85:
-            # もしホワイトリストでなければ
-            if dict_original not in whitelist and dict_norm not in whitelist:
-                found_offensive.append(dict_original)
-                print(f"[DEBUG] partial_ratio={score} => {dict_norm} in {input_norm}")
-
-    # C) 個人攻撃 + 犯罪組織
-    surnames = load_surnames()
-    if any(sn in text for sn in surnames) and any(neg in text for neg in ["きらい", "嫌い", "憎い"]):
-        judgement = "⚠️ 個人攻撃の可能性あり"
-        detail = "※個人名と否定的な表現の組み合わせが検出されました。"
-        _eval_cache[text] = (judgement, detail)
-        return (judgement, detail)
-
-    # D) offensive_list にヒットした場合
-    surnames = load_surnames()
-    if found_offensive:
-        judgement = "⚠️ 一部の表現が問題の可能性"
-        detail = "※この判定は約束できるものではありません。専門家にご相談ください。"
-        _eval_cache[text] = (judgement, detail)
-        return (judgement, detail)
-
-    # E) 以下、暴力・ハラスメント・脅迫などを substring/fuzzy で判定
-    # --------------------------------------------------
-    surnames = load_surnames()
-    violence_keywords = ["殺す", "死ね", "殴る", "蹴る", "刺す", "轢く", "焼く", "爆破", "死んでしまえ"]
-    if any(fuzz.partial_ratio(kw, input_norm) >= 90 for kw in violence_keywords):
-        judgement = "⚠️ 暴力的表現あり"
-        detail = "※この判定は約束できるものではありません。専門家にご相談ください。"
-        _eval_cache[text] = (judgement, detail)
-        return (judgement, detail)
-
-    surnames = load_surnames()
-    harassment_kws = ["お前消えろ", "存在価値ない", "いらない人間", "死んだほうがいい", "社会のゴミ"]
-    if any(fuzz.partial_ratio(kw, input_norm) >= 90 for kw in harassment_kws):
-        judgement = "⚠️ ハラスメント表現あり"
-        detail = "※この判定は約束できるものではありません。専門家にご相談ください。"
-        _eval_cache[text] = (judgement, detail)
-        return (judgement, detail)
-
-    surnames = load_surnames()
-    threat_kws = ["晒す", "特定する", "ぶっ壊す", "復讐する", "燃やす", "呪う", "報復する"]
-    if any(fuzz.partial_ratio(kw, input_norm) >= 90 for kw in threat_kws):
-        judgement = "⚠️ 脅迫表現あり"
-        detail = "※この判定は約束できるものではありません。専門家にご相談ください。"
-        _eval_cache[text] = (judgement, detail)
-        return (judgement, detail)
-
-    # F) 問題なし
-    _eval_cache[text] = ("問題ありません", "")
-    return ("問題ありません", "")
+    # 次に、他のワーカー（や再起動前の自分）の結果を共有ストアから探す
+    store = _result_store
+    key = None
+    if store is not None:
+        key = result_key(normalize_text(text), version)
+        try:
+            cached = store.get(key)
+        except Exception as e:
+            print(f"⚠️ 結果ストアの読み込みに失敗: {e}")
+            cached = None
+        if cached is not None:
+            _eval_cache_put(cache_key, cached)
+            return cached
+
+    report = run_pipeline(text, offensive_list, whitelist, mode="first_hit")
+    result = (report["judgement"], report["detail"])
+    _eval_cache_put(cache_key, result)
+    if key is not None:
+        try:
+            store.set(key, result)
+        except Exception as e:
+            print(f"⚠️ 結果ストアへの書き込みに失敗: {e}")
+    return result
+
+def evaluate_text_report(text: str, offensive_list, whitelist=None) -> dict:
+    """
+    全ステージを実行し、ヒットした語・カテゴリをすべて含むレポートを返す（モデレーション / デバッグ用）
+    """
+    return run_pipeline(text, offensive_list, whitelist, mode="full")
 
 # =========================================
 # 5) テスト実行
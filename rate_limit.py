@@ -0,0 +1,283 @@
+import os
+import math
+import time
+import random
+import uuid
+import sqlite3
+import threading
+from functools import wraps
+
+from flask import current_app, request, jsonify, make_response
+from flask_login import current_user
+
+# =========================================
+# 評価エンドポイント用のレート制限 + アドミッション制御
+# =========================================
+#   - ユーザー（または IP）ごとの token bucket
+#   - 待ち行列で待たされた時間が閾値を超えたリクエストは、評価せずに 429 + Retry-After で断る
+#   - 評価処理の同時実行数（ノード全体）が閾値を超えたら 429 + Retry-After で即座に断る
+# 待ち時間は、前段のルーター / プロキシが付ける X-Request-Start（受付時刻）からワーカーが受け取るまでの時間。
+# Procfile の gunicorn は sync ワーカー（1 ワーカー 1 スレッド）なので、混雑するとリクエストは
+# ワーカーの外（listen キュー）で待たされ、同時実行数はワーカー数より増えない。
+# 同時実行数では混雑を検知できないので、待ち時間で断る（バックエンドによらず、どのワーカーでも判定できる）。
+# バックエンド:
+#   - "memory" : プロセス内（gunicorn のワーカーごとに独立）。token bucket のみ
+#   - "sqlite" : 同一ノードの全ワーカーで共有（WAL モードの SQLite ファイル）。token bucket + 同時実行数
+# 同時実行数の制御はスレッド付きワーカー（--threads）向けで、sqlite バックエンドのときだけ有効。
+#
+# app.config / 環境変数:
+#   RATE_LIMIT_BACKEND          "memory"（既定） / "sqlite"
+#   RATE_LIMIT_SQLITE_PATH      sqlite バックエンドのファイル（既定: DATA_DIR/ratelimit.sqlite3）
+#   RATE_LIMIT_<SCOPE>          "回数/秒数"  例: RATE_LIMIT_QUICK_CHECK="30/60"
+#   MAX_QUEUE_TIME              これ以上（秒）待たされたリクエストは断る（0 で無効。X-Request-Start が無ければ判定しない）
+#   MAX_INFLIGHT_EVALUATIONS    ノード全体で同時に評価できる数（0 で無効。sqlite バックエンドのときだけ効く）
+#   INFLIGHT_TTL                評価スロットの有効期限（秒）。落ちたワーカーの分を回収するため
+#   TRUSTED_PROXY_COUNT         前段の信頼できるプロキシ数（create_app() が ProxyFix に渡す。既定 0 = X-Forwarded-For を無視）
+
+DEFAULT_LIMITS = {
+    "quick_check": "30/60",
+    "api_quick_check": "120/60",
+    "api_documents": "600/60",   # 入力中の編集ごとに呼ばれる
+    "report_offensive": "10/60",
+}
+DEFAULT_MAX_QUEUE_TIME = 1.0
+DEFAULT_MAX_INFLIGHT = 8
+DEFAULT_INFLIGHT_TTL = 30.0
+
+
+def parse_limit(value):
+    """
+    "30/60" → (capacity=30, rate=0.5 tokens/sec)
+    """
+    count, _, period = str(value).partition("/")
+    capacity = float(count)
+    period = float(period or 1)
+    if capacity <= 0 or period <= 0:
+        raise ValueError(f"不正なレート制限の指定です: {value}")
+    return capacity, capacity / period
+
+
+def _refill(tokens, updated, now, capacity, rate):
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+class MemoryBackend:
+    """
+    プロセス内の token bucket（同時実行数は数えない。同時実行数の制御は SQLiteBackend のみ）。
+    SQLiteBackend と同じく、バケットごとに満タンまで回復する時刻（full_at）を持ち、それを過ぎたものを消す。
+    掃除はバケット数が前回の掃除後の 2 倍（最低 _PRUNE_SIZE）を超えたときだけ行う（全件を見る回数を抑える）
+    """
+
+    _PRUNE_SIZE = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}      # key → (tokens, updated, full_at)
+        self._prune_at = self._PRUNE_SIZE
+
+    def take(self, key, capacity, rate, cost=1.0):
+        now = time.time()
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (capacity, now, now))
+            tokens = _refill(tokens, updated, now, capacity, rate)
+            if tokens >= cost:
+                tokens -= cost
+                allowed, retry_after = True, 0.0
+            else:
+                allowed, retry_after = False, (cost - tokens) / rate
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            if len(self._buckets) > self._prune_at:
+                self._prune(now)
+        return allowed, retry_after
+
+    def _prune(self, now):
+        # 満タンまで回復しているバケットは消しても結果が変わらない（scope ごとの capacity / rate は full_at に反映済み）
+        self._buckets = {k: v for k, v in self._buckets.items() if v[2] >= now}
+        self._prune_at = max(self._PRUNE_SIZE, 2 * len(self._buckets))
+
+
+class SQLiteBackend:
+    """
+    同一ノードのワーカー間で共有する token bucket / 同時実行カウンタ。
+    BEGIN IMMEDIATE で書き込みロックを取ってから読み書きするので、更新が競合しない。
+    バケットごとに満タンまで回復する時刻（full_at）を持ち、それを過ぎたものはときどき消す
+    （MemoryBackend._prune と同じく、満タンのバケットは消しても結果が変わらない）
+    """
+
+    _PRUNE_PROBABILITY = 0.001  # take 1000 回に 1 回くらい掃除する
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL, full_at REAL)")
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(buckets)")}
+        if "full_at" not in columns:  # 以前のファイル
+            conn.execute("ALTER TABLE buckets ADD COLUMN full_at REAL DEFAULT 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS buckets_full_at ON buckets (full_at)")
+        conn.execute("CREATE TABLE IF NOT EXISTS inflight (slot TEXT PRIMARY KEY, started REAL)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, capacity, rate, cost=1.0):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = _refill(row[0], row[1], now, capacity, rate) if row else capacity
+            if tokens >= cost:
+                allowed, retry_after = True, 0.0
+                tokens -= cost
+            else:
+                allowed, retry_after = False, (cost - tokens) / rate
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)",
+                (key, tokens, now, now + (capacity - tokens) / rate),
+            )
+            if random.random() < self._PRUNE_PROBABILITY:
+                conn.execute("DELETE FROM buckets WHERE full_at < ?", (now,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, retry_after
+
+    def acquire_slot(self, limit, ttl):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM inflight WHERE started < ?", (now - ttl,))
+            (count,) = conn.execute("SELECT COUNT(*) FROM inflight").fetchone()
+            slot = None
+            if count < limit:
+                slot = uuid.uuid4().hex
+                conn.execute("INSERT INTO inflight (slot, started) VALUES (?, ?)", (slot, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return slot
+
+    def release_slot(self, slot):
+        self._conn().execute("DELETE FROM inflight WHERE slot = ?", (slot,))
+
+
+def request_queue_time(now=None):
+    """
+    X-Request-Start（前段が付ける受付時刻）から今までの秒数。ヘッダーが無い・読めなければ None
+    単位は前段によって違う: 秒（nginx の "t=${msec}"）/ ミリ秒（Heroku のルーター）/ マイクロ秒（Apache の "t=%t"）
+    """
+    value = request.headers.get("X-Request-Start", "").strip()
+    if value.startswith("t="):
+        value = value[2:]
+    try:
+        started = float(value)
+    except ValueError:
+        return None
+    if started > 1e14:
+        started /= 1e6
+    elif started > 1e11:
+        started /= 1e3
+    return max(0.0, (now or time.time()) - started)
+
+
+def user_key():
+    """ログインユーザー単位（未ログインなら IP）"""
+    if current_user and current_user.is_authenticated:
+        return f"user:{current_user.id}"
+    return ip_key()
+
+
+def ip_key():
+    """
+    クライアント IP（request.remote_addr）。
+    X-Forwarded-For はクライアントが任意に付けられるので、ここでは読まない。
+    信頼できるプロキシ（Heroku のルーターなど）の後ろで動かすときは、
+    create_app() が TRUSTED_PROXY_COUNT に応じて ProxyFix を掛け、remote_addr を実際のクライアントにする
+    """
+    return f"ip:{request.remote_addr}"
+
+
+class RateLimiter:
+    def __init__(self, app=None):
+        self.backend = None
+        self.admission_control = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.get("RATE_LIMIT_BACKEND") or os.getenv("RATE_LIMIT_BACKEND", "memory")
+        if backend == "sqlite":
+            path = app.config.get("RATE_LIMIT_SQLITE_PATH") or os.getenv("RATE_LIMIT_SQLITE_PATH") or os.path.join(
+                os.getenv("DATA_DIR") or os.path.join(app.root_path, "data"), "ratelimit.sqlite3"
+            )
+            self.backend = SQLiteBackend(path)
+            self.admission_control = True
+        elif backend == "memory":
+            self.backend = MemoryBackend()
+            self.admission_control = False
+            if int(app.config.get("MAX_INFLIGHT_EVALUATIONS") or os.getenv("MAX_INFLIGHT_EVALUATIONS") or 0) > 0:
+                print("⚠️ MAX_INFLIGHT_EVALUATIONS は RATE_LIMIT_BACKEND=sqlite のときだけ有効です（memory では無視します）")
+        else:
+            raise ValueError(f"unknown RATE_LIMIT_BACKEND: {backend}")
+        app.extensions["rate_limiter"] = self
+
+    def _setting(self, name, default):
+        value = current_app.config.get(name)
+        if value is None:
+            value = os.getenv(name, default)
+        return value
+
+    def _too_many(self, retry_after, message):
+        seconds = max(1, int(math.ceil(retry_after)))
+        if request.is_json or request.path.startswith("/api/") or request.path == "/report_offensive":
+            response = make_response(jsonify({"status": "error", "message": message}), 429)
+        else:
+            response = make_response(f"<h2>{message}</h2>", 429)
+        response.headers["Retry-After"] = str(seconds)
+        return response
+
+    def limit(self, scope, key_func=user_key):
+        """
+        待ち時間 / 評価の同時実行数によるアドミッション制御 + token bucket（scope ごと・key_func の値ごと）
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                # 待たされすぎたリクエストは評価しても間に合わないので、トークンを消費させずに断る
+                max_queue_time = float(self._setting("MAX_QUEUE_TIME", DEFAULT_MAX_QUEUE_TIME))
+                queue_time = request_queue_time() if max_queue_time > 0 else None
+                if queue_time is not None and queue_time > max_queue_time:
+                    return self._too_many(1, "混み合っています。しばらく待ってから再度お試しください。")
+
+                capacity, rate = parse_limit(
+                    self._setting(f"RATE_LIMIT_{scope.upper()}", DEFAULT_LIMITS.get(scope, "30/60"))
+                )
+                allowed, retry_after = self.backend.take(f"{scope}:{key_func()}", capacity, rate)
+                if not allowed:
+                    return self._too_many(retry_after, "リクエストが多すぎます。しばらく待ってから再度お試しください。")
+
+                max_inflight = int(self._setting("MAX_INFLIGHT_EVALUATIONS", DEFAULT_MAX_INFLIGHT))
+                if not self.admission_control or max_inflight <= 0:
+                    return view(*args, **kwargs)
+
+                ttl = float(self._setting("INFLIGHT_TTL", DEFAULT_INFLIGHT_TTL))
+                slot = self.backend.acquire_slot(max_inflight, ttl)
+                if slot is None:
+                    return self._too_many(1, "混み合っています。しばらく待ってから再度お試しください。")
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    self.backend.release_slot(slot)
+            return wrapper
+        return decorator
@@ -5,10 +5,15 @@ sys.path.append(os.path.abspath(os.path.dirname(__file__)))  # 必要なら
 from flask import Blueprint, render_template, request, current_app, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from models.search_history import SearchHistory
-from models.text_evaluation import evaluate_text  # evaluate_text のみインポート
+from models.text_evaluation import evaluate_text, build_tenant_prefilter
+from models.incremental import EditError
 from models.report_history import ReportHistory   # ← 後で作成するモデルをインポート
+from models.custom_dictionary import CustomDictionaryEntry, OWNER_USER, KIND_OFFENSIVE, KIND_WHITELIST
+from models.tenant_dictionary import get_tenant_matchers
 from sqlalchemy import text
-from extensions import db
+from sqlalchemy.exc import IntegrityError
+from extensions import db, limiter
+from rate_limit import ip_key
 
 print("✅ main.py が読み込まれました！")
 
@@ -26,6 +31,24 @@ def debug_columns():
         print(r[0])
     return "OK"
 
+def _json_body():
+    """
+    JSON のオブジェクトなら dict、それ以外（不正な JSON・配列など）は空の dict
+    """
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else {}
+
+def _current_matchers():
+    """
+    ログインユーザーに効く辞書（グローバル + 組織 / 本人の追加辞書）
+    """
+    offensive_list = current_app.config.get("OFFENSIVE_LIST", [])
+    global_whitelist = current_app.config.get("WHITELIST_MATCHER") or current_app.config.get("WHITELIST_SET", set())
+    cache = current_app.config.get("TENANT_MATCHER_CACHE")
+    if cache is None or not current_user.is_authenticated:
+        return offensive_list, global_whitelist
+    return get_tenant_matchers(current_user.id, offensive_list, global_whitelist, cache)
+
 @main.route("/")
 def home():
     print("✅ / にアクセスされました")
@@ -33,13 +56,13 @@ def home():
 
 @main.route("/quick_check", methods=["POST"])
 @login_required
+@limiter.limit("quick_check")
 def quick_check():
     query = request.form.get("text", "").strip()
 
     with current_app.app_context():
-        # create_app() 側で token 化済みのリストをセットしてある
-        offensive_list = current_app.config.get("OFFENSIVE_LIST", [])
-        global_whitelist = current_app.config.get("WHITELIST_SET", set())
+        # create_app() 側で token 化済みのリストをセットしてある（テナントの追加辞書があれば重ねる）
+        offensive_list, whitelist = _current_matchers()
 
     # ▼ デバッグ出力例（必要なら）
     # print("[DEBUG] quick_check: len(offensive_list) =", len(offensive_list))
@@ -47,14 +70,214 @@ def quick_check():
     #     print("[DEBUG] first item in offensive_list:", offensive_list[0])
 
     # テキストを判定する
-    judgement, detail = evaluate_text(query, offensive_list, global_whitelist)
+    judgement, detail = evaluate_text(query, offensive_list, whitelist)
 
     # 検索履歴を保存
     SearchHistory.add_or_increment(query)
 
     return render_template("result.html", query=query, result=judgement, detail=detail)
 
+@main.route("/api/quick_check", methods=["POST"])
+@login_required
+@limiter.limit("api_quick_check")
+def api_quick_check():
+    """
+    detector.js がプレフィルタで「要確認」と判断した入力だけを送ってくる JSON API
+    例: { "text": "..." } → { "result": "...", "detail": "..." }
+    入力途中の問い合わせなので検索履歴には保存しない
+    """
+    data = _json_body()
+    query = data.get("text") or ""
+    if not isinstance(query, str):
+        return jsonify({"status": "error", "message": "text は文字列で指定してください"}), 400
+    query = query.strip()
+
+    offensive_list, whitelist = _current_matchers()
+
+    judgement, detail = evaluate_text(query, offensive_list, whitelist)
+    return jsonify({"result": judgement, "detail": detail}), 200
+
+# ---- 入力途中のインクリメンタル判定 ----
+#   文書 ID はクライアントが決める（ユーザーごとに分離）。文書は文書ストアでワーカー間に共有する。
+#   404 / 409 が返ったら、クライアントは全文を POST し直す（期限切れ・ずれ・編集の競合）
+
+def _document_key(doc_id):
+    return f"{current_user.id}:{doc_id}"
+
+@main.route("/api/documents/<doc_id>", methods=["POST"])
+@login_required
+@limiter.limit("api_documents")
+def open_document(doc_id):
+    """
+    例: { "text": "全文" } → 判定
+    """
+    data = _json_body()
+    text_ = data.get("text") or ""
+    if not isinstance(text_, str):
+        return jsonify({"status": "error", "message": "text は文字列で指定してください"}), 400
+    evaluator = current_app.config["INCREMENTAL_EVALUATOR"]
+    offensive_list, whitelist = _current_matchers()
+    report = evaluator.open(_document_key(doc_id), text_, offensive_list, whitelist)
+    return jsonify(_document_response(doc_id, report)), 200
+
+@main.route("/api/documents/<doc_id>/edits", methods=["POST"])
+@login_required
+@limiter.limit("api_documents")
+def edit_document(doc_id):
+    """
+    例: { "offset": 12, "delete": 0, "insert": "ね", "length": 30 } → 判定
+    length は編集後の全文の長さ（ずれ検出用、省略可）
+    """
+    data = _json_body()
+    try:
+        offset = int(data.get("offset", 0))
+        delete = int(data.get("delete", 0))
+        length = data.get("length")
+        length = int(length) if length is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "offset / delete / length は整数で指定してください"}), 400
+    insert = data.get("insert") or ""
+    if not isinstance(insert, str):
+        return jsonify({"status": "error", "message": "insert は文字列で指定してください"}), 400
+
+    evaluator = current_app.config["INCREMENTAL_EVALUATOR"]
+    offensive_list, whitelist = _current_matchers()
+    try:
+        report = evaluator.apply_edit(
+            _document_key(doc_id), offset, delete, insert, expected_length=length,
+            offensive_list=offensive_list, whitelist=whitelist,
+        )
+    except KeyError:
+        return jsonify({"status": "unknown_document", "message": "全文を送り直してください"}), 404
+    except EditError as e:
+        return jsonify({"status": "out_of_sync", "message": str(e)}), 409
+    return jsonify(_document_response(doc_id, report)), 200
+
+@main.route("/api/documents/<doc_id>", methods=["DELETE"])
+@login_required
+def close_document(doc_id):
+    current_app.config["INCREMENTAL_EVALUATOR"].close(_document_key(doc_id))
+    return jsonify({"status": "OK"}), 200
+
+def _document_response(doc_id, report):
+    return {
+        "doc_id": doc_id,
+        "result": report["judgement"],
+        "detail": report["detail"],
+        "categories": report["categories"],
+        "length": report["length"],
+        "segments": report["segments"],
+        "reevaluated": report["reevaluated"],
+    }
+
+# ---- テナント（本人）の追加辞書 ----
+#   kind = "offensive"（追加で検出する語） / "whitelist"（このユーザーでは検出しない語）
+#   組織の辞書は organization_member で所属を登録し、owner_type="organization" のエントリとして持つ
+
+MAX_CUSTOM_WORDS = 1000
+MAX_CUSTOM_WORD_LENGTH = 100
+
+@main.route("/api/dictionary", methods=["GET"])
+@login_required
+def list_dictionary():
+    entries = CustomDictionaryEntry.query.filter_by(
+        owner_type=OWNER_USER, owner_id=current_user.id
+    ).order_by(CustomDictionaryEntry.id).all()
+    return jsonify({"entries": [e.to_dict() for e in entries]}), 200
+
+@main.route("/api/dictionary", methods=["POST"])
+@login_required
+def add_dictionary_entry():
+    """
+    例: { "word": "〇〇", "kind": "offensive" }
+    """
+    data = _json_body()
+    word = data.get("word") or ""
+    kind = data.get("kind", KIND_OFFENSIVE)
+    word = word.strip() if isinstance(word, str) else ""
+    if not word or len(word) > MAX_CUSTOM_WORD_LENGTH or kind not in (KIND_OFFENSIVE, KIND_WHITELIST):
+        return jsonify({"status": "error", "message": "word / kind が不正です"}), 400
+
+    query = CustomDictionaryEntry.query.filter_by(owner_type=OWNER_USER, owner_id=current_user.id)
+    existing = query.filter_by(kind=kind, word=word).first()
+    if existing:
+        return jsonify({"status": "OK", "entry": existing.to_dict()}), 200
+    if query.count() >= MAX_CUSTOM_WORDS:
+        return jsonify({"status": "error", "message": f"登録できるのは {MAX_CUSTOM_WORDS} 件までです"}), 400
+
+    entry = CustomDictionaryEntry(owner_type=OWNER_USER, owner_id=current_user.id, kind=kind, word=word)
+    db.session.add(entry)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # 同じ語の登録が並行して先にコミットされた（uq_custom_dictionary_entry）。そちらを返す
+        db.session.rollback()
+        existing = query.filter_by(kind=kind, word=word).first()
+        if existing is None:
+            raise
+        _invalidate_current_user_dictionary()  # 先にコミットしたのが別のワーカーでも、このワーカーにすぐ反映する
+        return jsonify({"status": "OK", "entry": existing.to_dict()}), 200
+    _invalidate_current_user_dictionary()
+    return jsonify({"status": "OK", "entry": entry.to_dict()}), 201
+
+@main.route("/api/dictionary/<int:entry_id>", methods=["DELETE"])
+@login_required
+def delete_dictionary_entry(entry_id):
+    entry = CustomDictionaryEntry.query.filter_by(
+        id=entry_id, owner_type=OWNER_USER, owner_id=current_user.id
+    ).first()
+    if entry is None:
+        return jsonify({"status": "error", "message": "見つかりません"}), 404
+    db.session.delete(entry)
+    db.session.commit()
+    _invalidate_current_user_dictionary()
+    return jsonify({"status": "OK"}), 200
+
+def _invalidate_current_user_dictionary():
+    cache = current_app.config.get("TENANT_MATCHER_CACHE")
+    if cache is not None:
+        cache.invalidate((OWNER_USER, current_user.id))
+
+@main.route("/prefilter.json")
+def prefilter():
+    """
+    クライアント用プレフィルタ。hash を ETag にして、変わっていなければ 304 を返す
+    """
+    payload = current_app.config.get("PREFILTER")
+    if not payload:
+        return jsonify({"status": "unavailable"}), 404
+
+    etag = payload["hash"]
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "public, max-age=300"
+    return response
+
+@main.route("/api/prefilter/tenant")
+def tenant_prefilter():
+    """
+    ログインユーザーの追加辞書（組織 + 本人）ぶんのプレフィルタ（未ログイン・追加辞書なしなら status=none）。
+    detector.js は /prefilter.json と両方を見て、どちらかに当たればサーバーに問い合わせる
+    """
+    offensive_list, _ = _current_matchers()
+    payload = build_tenant_prefilter(offensive_list)
+    if not payload:
+        return jsonify({"status": "none"}), 200
+
+    etag = payload["hash"]
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"  # 辞書を編集したらすぐ反映されるように毎回確認させる
+    return response
+
 @main.route("/report_offensive", methods=["POST"])
+@limiter.limit("report_offensive", key_func=ip_key)
 def report_offensive():
     """
     ユーザーが「誤判定」と思ったら POST するAPI
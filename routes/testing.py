@@ -0,0 +1,27 @@
+from flask import Blueprint, jsonify
+from flask_login import login_user
+from models import User
+from extensions import db
+
+# 負荷試験専用のログイン代替。
+# create_app() が MOJITAP_TEST_LOGIN=1 かつ SQLite のときだけ登録する（本番では存在しない）
+testing = Blueprint("testing", __name__)
+
+@testing.route("/_test/login/<user_id>", methods=["POST"])
+def test_login(user_id):
+    """
+    OAuth を通さずに、指定した ID のユーザーとしてログインする
+    """
+    user = User.query.get(user_id)
+    if not user:
+        user = User(
+            id=user_id,
+            email=f"{user_id}@example.com",
+            display_name=f"loadtest-{user_id}",
+            provider="test"
+        )
+        db.session.add(user)
+        db.session.commit()
+
+    login_user(user)
+    return jsonify({"status": "OK", "user_id": user.id}), 200
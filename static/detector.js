@@ -80,9 +80,172 @@ function classifyScore(score) {
   }
 }
 
-console.log("テスト実行：");
-const userInput = "お前なんて要らない。さっさと消えろ。";
-const totalScore = analyzeText(userInput, dictionary);
-const resultMessage = classifyScore(totalScore);
-console.log("スコア:", totalScore);
-console.log("判定結果:", resultMessage);
+/***************************************
+ * プレフィルタ（サーバー辞書の Bloom filter）
+ *   GET /prefilter.json で取得し、明らかに問題ない入力はその場で「問題なし」にする。
+ *   ヒットの可能性があるときだけ /api/quick_check に問い合わせる。
+ *   ハッシュ・正規化は models/prefilter.py / normalize_text と一致させること。
+ ****************************************/
+
+const FNV_OFFSET = 0x811c9dc5;
+const FNV_PRIME = 0x01000193;
+
+function fnv1a(text, h) {
+  for (const ch of text) {
+    h = Math.imul(h ^ ch.codePointAt(0), FNV_PRIME) >>> 0;
+  }
+  return h;
+}
+
+// normalize_text と同じ: 半角カナ → 全角カナ、ｰ → ー、ひらがな → カタカナ
+function normalizeForPrefilter(text) {
+  return text
+    .replace(/[\uFF61-\uFF9F]+/g, s => s.normalize("NFKC"))
+    .replace(/ｰ/g, "ー")
+    .replace(/[\u3041-\u3096\u309D\u309E]/g, ch => String.fromCharCode(ch.charCodeAt(0) + 0x60))
+    .replace(/\s+/g, "");
+}
+
+function createPrefilter(payload) {
+  const raw = atob(payload.bits);
+  const bits = new Uint8Array(raw.length);
+  for (let i = 0; i < raw.length; i++) {
+    bits[i] = raw.charCodeAt(i);
+  }
+  const seed1 = fnv1a(payload.salt + "\x00", FNV_OFFSET);
+  const seed2 = fnv1a(payload.salt + "\x01", FNV_OFFSET);
+
+  function has(gram) {
+    const h1 = fnv1a(gram, seed1);
+    const h2 = (fnv1a(gram, seed2) | 1) >>> 0;
+    for (let i = 0; i < payload.k; i++) {
+      const idx = (h1 + i * h2) % payload.m;  // k は小さいので 2^53 を超えない
+      if (!(bits[idx >> 3] & (1 << (idx & 7)))) {
+        return false;
+      }
+    }
+    return true;
+  }
+
+  // true = 辞書にヒットする可能性あり（サーバーで確認が必要）
+  function mightMatch(text) {
+    const chars = Array.from(normalizeForPrefilter(text));
+    if (chars.length === 0) {
+      return false;
+    }
+    if (chars.length <= payload.n) {
+      return true;  // 短文は辞書語の一部と部分一致しうる
+    }
+    for (let i = 0; i < chars.length; i++) {
+      let gram = "";
+      for (let len = 1; len <= payload.n && i + len <= chars.length; len++) {
+        gram += chars[i + len - 1];
+        if (has(gram)) {
+          return true;
+        }
+      }
+    }
+    return false;
+  }
+
+  return { version: payload.version, hash: payload.hash, mightMatch };
+}
+
+let prefilterPromise = null;
+
+function fetchPrefilter(url, options = {}) {
+  return fetch(url, { credentials: "same-origin", ...options })
+    .then(res => (res.ok ? res.json() : null))
+    .then(payload => (payload && payload.bits ? createPrefilter(payload) : null))
+    .catch(() => null);
+}
+
+// グローバル辞書のプレフィルタ + ログインユーザーの追加辞書（組織 / 本人）のプレフィルタ。
+// どちらかに当たればサーバーで確認する。追加辞書の読み込みに失敗したときは常にサーバーへ問い合わせる
+function loadPrefilter(url = "/prefilter.json", tenantUrl = "/api/prefilter/tenant") {
+  if (!prefilterPromise) {
+    const tenant = fetch(tenantUrl, { credentials: "same-origin", cache: "no-cache" })
+      .then(res => (res.ok ? res.json() : null))
+      .then(payload => {
+        if (!payload) {
+          return null;
+        }
+        return payload.bits ? createPrefilter(payload) : { none: true };  // status=none: 追加辞書なし
+      })
+      .catch(() => null);
+    prefilterPromise = Promise.all([fetchPrefilter(url), tenant]).then(([global, overlay]) => {
+      if (!global || !overlay) {
+        return null;  // どちらかが使えなければ絞り込まない
+      }
+      if (overlay.none) {
+        return global;
+      }
+      return {
+        version: global.version + "+" + overlay.version,
+        hash: global.hash + "+" + overlay.hash,
+        mightMatch: text => global.mightMatch(text) || overlay.mightMatch(text),
+      };
+    });
+  }
+  return prefilterPromise;
+}
+
+// 追加辞書を編集したあとに呼ぶ（次の入力から新しいプレフィルタを使う）
+function reloadPrefilter() {
+  prefilterPromise = null;
+}
+
+// textarea の入力ごとに即時チェック。プレフィルタに当たったときだけサーバーへ
+function attachLiveCheck(textarea, output, { delay = 400 } = {}) {
+  let timer = null;
+  let seq = 0;
+
+  textarea.addEventListener("input", () => {
+    const text = textarea.value;
+    const current = ++seq;
+    clearTimeout(timer);
+
+    loadPrefilter().then(prefilter => {
+      if (current !== seq) {
+        return;
+      }
+      if (!text.trim()) {
+        output.textContent = "";
+        return;
+      }
+      if (prefilter && !prefilter.mightMatch(text)) {
+        output.textContent = "問題ありません（簡易チェック）";
+        return;
+      }
+      output.textContent = "確認中…";
+      timer = setTimeout(() => {
+        fetch("/api/quick_check", {
+          method: "POST",
+          credentials: "same-origin",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({ text })
+        })
+          .then(res => (res.ok ? res.json() : null))  // 429（混雑・回数制限）のときは表示しない
+          .then(data => {
+            if (current === seq) {
+              output.textContent = data ? data.result : "";
+            }
+          })
+          .catch(() => {
+            if (current === seq) {
+              output.textContent = "";
+            }
+          });
+      }, delay);
+    });
+  });
+}
+
+if (typeof window === "undefined") {
+  console.log("テスト実行：");
+  const userInput = "お前なんて要らない。さっさと消えろ。";
+  const totalScore = analyzeText(userInput, dictionary);
+  const resultMessage = classifyScore(totalScore);
+  console.log("スコア:", totalScore);
+  console.log("判定結果:", resultMessage);
+}
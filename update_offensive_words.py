@@ -1,44 +1,268 @@
 import os
+import re
+import sys
 import json
+import time
+import hashlib
+import unicodedata
+
+import pykakasi
+from sudachipy import dictionary  # ja_core_news_sm（spaCy の日本語モデル）の依存として入っている
 
 SURNAMES_FOLDER = os.path.join(os.path.dirname(__file__), "surnames_split")
-JSON_PATH = os.path.join(os.path.dirname(__file__), "data", "offensive_words.json")
+DATA_FOLDER = os.path.join(os.path.dirname(__file__), "data")
+JSON_PATH = os.path.join(DATA_FOLDER, "offensive_words.json")
+
+# 増分ビルド用のファイル群
+#   manifest : ファイルごとの sha256 と、そのファイルから取り出した人名・読み
+#   artifact : 全人名をソート済み配列で持つコンパクトな成果物（バージョン付き）
+#              + 人名 → カタカナ読み（pykakasi で事前計算。実行時には kakasi を使わない）
+#                普通の語と同じ読み（ミンナ・オトナ など）や「語 + 助詞」の読み（イヌガ など）は入れない
+#   diff     : 直前のビルドからの追加・削除
+MANIFEST_PATH = os.path.join(DATA_FOLDER, "surnames_manifest.json")
+ARTIFACT_PATH = os.path.join(DATA_FOLDER, "surnames.json")
+DIFF_PATH = os.path.join(DATA_FOLDER, "surnames_diff.json")
+
+ARTIFACT_FORMAT = 3  # models/load_surnames.py の READINGS_FORMAT と揃える
+
+# これより短い読みは普通の語の一部と区別できないので、読みの索引には入れない
+MIN_READING_LENGTH = 3
+
+# 実行時に読みの直後に続いてよい敬称・助詞（models/text_evaluation.py の _READING_SUFFIXES と揃える）
+_READING_SUFFIXES = (
+    "さん", "くん", "ちゃん", "さま", "せんせい", "し",
+    "って", "は", "が", "の", "を", "も", "と", "に", "へ", "ってば", "なんて",
+)
+
+_KATAKANA_READING = re.compile(r"^[ァ-ヶー]+$")
+_kakasi = None
+_tokenizer = None
+
+
+def _read_json(path, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
+
+
+def _write_json(path, data, compact=True):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        if compact:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        else:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, path)  # 書き込み途中のファイルを読まれないように
+
+
+def _row_initials(filename):
+    """
+    "surnames_か行.json" → {"か"}、"surnames_ら〜ろ行.json" → {"ら", "り", "る", "れ", "ろ"}
+    """
+    row = filename[len("surnames_"):].rsplit("行", 1)[0]
+    if "〜" in row:
+        first, last = row.split("〜")
+        return {chr(c) for c in range(ord(first), ord(last) + 1)}
+    return set(row)
+
+
+def _base_kana(ch):
+    # 濁点・半濁点を外す（が → か、ぱ → は）
+    return unicodedata.normalize("NFD", ch)[0]
+
+
+def _reading(name, initials):
+    """
+    pykakasi でカタカナ読みを求める。
+    読みの頭文字がファイルの行（あ行・か行…）と合わない場合は誤読とみなして捨てる
+    """
+    global _kakasi
+    if _kakasi is None:
+        _kakasi = pykakasi.kakasi()
+    parts = _kakasi.convert(name)
+    kana = "".join(p["kana"] for p in parts)
+    hira = "".join(p["hira"] for p in parts)
+    if len(kana) < MIN_READING_LENGTH or not _KATAKANA_READING.match(kana):
+        return None
+    if initials and _base_kana(hira[0]) not in initials:
+        return None
+    if _is_common_reading(hira, kana):
+        return None
+    return kana
+
+
+def _is_common_reading(hira, kana):
+    """
+    読みを形態素解析（SudachiPy）にかけ、苗字以外の語と区別できないものを判定する
+      - カタカナで辞書にある 1 語なら、固有名詞かどうかで決める（ヤマモト → 残す、ミンナ・オトナ・センセイ → 普通の語）
+      - ひらがなで辞書にある 1 語の普通の語（どうぶつ）、助詞で終わる（いぬ + が、あさ + が → 普通の語 + 助詞と区別できない）
+      - 敬称・助詞を続けると別の語に飲み込まれる（おとう + と → おとうと、おとう + さん → お + とうさん）
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = dictionary.Dictionary().create()
+    morphemes = _tokenizer.tokenize(kana)
+    if len(morphemes) == 1 and not morphemes[0].is_oov():
+        return morphemes[0].part_of_speech()[1] != "固有名詞"
+    morphemes = _tokenizer.tokenize(hira)
+    if len(morphemes) == 1 and not morphemes[0].is_oov():
+        return morphemes[0].part_of_speech()[1] != "固有名詞"
+    if morphemes[len(morphemes) - 1].part_of_speech()[0] == "助詞":
+        return True
+    return any(_absorbs_suffix(_tokenizer.tokenize(hira + suffix), len(hira)) for suffix in _READING_SUFFIXES)
+
+
+def _absorbs_suffix(morphemes, boundary):
+    """
+    読み + 敬称 / 助詞 が、（接頭辞を除いて）読みの途中から末尾までの 1 つの普通名詞になるか
+    """
+    for i in range(len(morphemes)):
+        m = morphemes[i]
+        if m.end() <= boundary:
+            if m.part_of_speech()[0] != "接頭辞":
+                return False
+            continue
+        return m.begin() < boundary and i == len(morphemes) - 1 and m.part_of_speech()[1] == "普通名詞"
+    return False
+
+
+def _parse_surname_file(raw: bytes, filename=""):
+    """
+    surnames_split/*.json（JSON配列）から人名と読みを取り出す
+    :return: (ソート済み人名リスト, {人名: [読み, ...]})
+    """
+    names = set()
+    for name in json.loads(raw.decode("utf-8")):
+        # 不要な見出し "な行" などが入っていれば除外する
+        if "行" in name:
+            continue
+        name = name.strip()
+        if name:
+            names.add(name)
+
+    initials = _row_initials(filename)
+    readings = {}
+    for name in sorted(names):
+        kana = _reading(name, initials)
+        if kana:
+            readings[name] = [kana]
+    return sorted(names), readings
+
+
+def build_surnames(force=False):
+    """
+    manifest を使った増分ビルド。
+    sha256 が変わったファイルだけを再パースし、それ以外は manifest の結果を再利用する。
+    :return: (names: ソート済みリスト, added: set, removed: set, stats: dict)
+    読み（data/surnames.json の "readings"）も同じ単位で増分計算する
+    """
+    manifest = _read_json(MANIFEST_PATH, {})
+    if manifest.get("format") != ARTIFACT_FORMAT or force:
+        manifest = {"format": ARTIFACT_FORMAT, "version": manifest.get("version", 0), "files": {}}
+    old_files = manifest.get("files", {})
+
+    new_files = {}
+    reparsed = []
+    for filename in sorted(os.listdir(SURNAMES_FOLDER)):
+        if not filename.endswith(".json"):
+            continue
+        with open(os.path.join(SURNAMES_FOLDER, filename), "rb") as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        entry = old_files.get(filename)
+        if entry and entry.get("sha256") == digest:
+            new_files[filename] = entry
+            continue
+        names, readings = _parse_surname_file(raw, filename)
+        new_files[filename] = {"sha256": digest, "names": names, "readings": readings}
+        reparsed.append(filename)
+
+    removed_files = sorted(set(old_files) - set(new_files))
+
+    old_artifact = _read_json(ARTIFACT_PATH, {})
+    old_names = set(old_artifact.get("names", []))
+    new_names = set()
+    readings = {}
+    for entry in new_files.values():
+        new_names.update(entry["names"])
+        for name, kana in entry["readings"].items():
+            readings.setdefault(name, [])
+            readings[name] = sorted(set(readings[name]) | set(kana))
+
+    added = new_names - old_names
+    removed = old_names - new_names
+    version = manifest.get("version", 0)
+    names = sorted(new_names)
+    readings = {name: readings[name] for name in sorted(readings)}
+
+    content_changed = (
+        added or removed
+        or old_artifact.get("format") != ARTIFACT_FORMAT
+        or old_artifact.get("readings") != readings
+    )
+    if content_changed:
+        version += 1
+        _write_json(ARTIFACT_PATH, {
+            "format": ARTIFACT_FORMAT,
+            "version": version,
+            "sha256": hashlib.sha256("\n".join(names).encode("utf-8")).hexdigest(),
+            "count": len(names),
+            "names": names,
+            "readings": readings,
+        })
+        _write_json(DIFF_PATH, {
+            "from_version": old_artifact.get("version", 0),
+            "to_version": version,
+            "added": sorted(added),
+            "removed": sorted(removed),
+        })
+
+    if reparsed or removed_files or version != manifest.get("version", 0):
+        _write_json(MANIFEST_PATH, {"format": ARTIFACT_FORMAT, "version": version, "files": new_files})
+
+    stats = {
+        "version": version,
+        "reparsed": reparsed,
+        "removed_files": removed_files,
+        "total_files": len(new_files),
+    }
+    return names, added, removed, stats
+
 
 def load_surnames():
-    surnames = set()
-    for filename in os.listdir(SURNAMES_FOLDER):
-        if filename.endswith(".json"):
-            with open(os.path.join(SURNAMES_FOLDER, filename), "r", encoding="utf-8") as f:
-                data_list = json.load(f)  # JSON配列をロード
-                for name in data_list:
-                    # 不要な見出し "な行" などが入っていれば除外する処理をする
-                    if "行" in name:
-                        continue
-                    surnames.add(name.strip())
-    return list(surnames)
-
-def update_offensive_words():
+    names, _, _, _ = build_surnames()
+    return names
+
+
+def update_offensive_words(force=False):
+    started = time.perf_counter()
+
+    # 人名データを増分ビルド（変更のあった行ファイルだけ読み直す）
+    names, added, removed, stats = build_surnames(force=force)
+
     # 既存の offensive_words を読み込む
-    try:
-        with open(JSON_PATH, "r", encoding="utf-8") as f:
-            offensive_words = json.load(f)
-    except FileNotFoundError:
+    offensive_words = _read_json(JSON_PATH, None)
+    if offensive_words is None:
         offensive_words = {"categories": {}, "names": []}
 
-    # 人名データを取得
-    surnames = load_surnames()  # あ行、か行…わ行 すべて読み込む
-
-    # "names" キーがなければ作る
-    if "names" not in offensive_words:
-        offensive_words["names"] = []
+    # set で差分を反映し、ソート済み配列として保持
+    current = set(offensive_words.get("names", []))
+    merged = (current | set(names)) - removed
+    if merged != current or "names" not in offensive_words:
+        offensive_words["names"] = sorted(merged)
+        _write_json(JSON_PATH, offensive_words, compact=False)
 
-    # surnames を "names" に追加（重複チェック）
-    for name in surnames:
-        if name not in offensive_words["names"]:
-            offensive_words["names"].append(name)
+    elapsed = time.perf_counter() - started
+    print(
+        f"✅ surnames v{stats['version']}: {len(names)} 件 "
+        f"(+{len(added)} / -{len(removed)}), "
+        f"再パース {len(stats['reparsed'])}/{stats['total_files']} ファイル, {elapsed:.3f}s"
+    )
+    return stats
 
-    # 更新したデータを書き込み
-    with open(JSON_PATH, "w", encoding="utf-8") as f:
-        json.dump(offensive_words, f, indent=4, ensure_ascii=False)
 
-    print(f"✅ `offensive_words.json` に {len(surnames)} 件の人名を追加しました！")
+if __name__ == "__main__":
+    update_offensive_words(force="--force" in sys.argv[1:])